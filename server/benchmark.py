@@ -0,0 +1,344 @@
+#!/usr/bin/python3
+
+"""benchmark.py: Provides micro-benchmarks for the bundled PyPDF2"""
+
+import argparse
+import gc
+import inspect
+import io
+import json
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from collections import OrderedDict
+
+from tool.pypdf2.PyPDF2 import PdfFileMerger, PdfFileReader, PdfFileWriter
+from tool.pypdf2.PyPDF2.generic import ArrayObject, DecodedStreamObject, DictionaryObject, IndirectObject, \
+    NameObject, NumberObject
+from tool.pypdf2.PyPDF2.pdf import PageObject
+
+__author__ = 'Jim Martens'
+
+# the synthetic documents: number of pages, text lines per page and the way they are written
+DOCUMENTS = OrderedDict([
+    ('classic', {'pages': 300, 'lines': 40, 'object_streams': False, 'compress': False}),
+    ('compact', {'pages': 300, 'lines': 40, 'object_streams': True, 'compress': True}),
+    ('large-content', {'pages': 10, 'lines': 20000, 'object_streams': False, 'compress': True})
+])
+
+# the number of copies that are merged by the merger benchmarks
+COPIES = 5
+
+# the size of the embedded font program that is shared by all pages
+FONT_SIZE = 32 * 1024
+
+
+class Unsupported(Exception):
+    """
+    Raised if the bundled PyPDF2 of the measured revision does not support an option of a benchmark.
+    """
+
+
+def main():
+    """Main function for the benchmarks"""
+    parser = argparse.ArgumentParser(description='Micro-benchmarks for the bundled PyPDF2')
+    parser.add_argument('--repeat', type=int, default=5, help='the number of timed runs of every benchmark')
+    parser.add_argument('--scale', type=float, default=1.0, help='the factor for the number of pages')
+    parser.add_argument('--filter', default='', help='only run the benchmarks that contain this text')
+    parser.add_argument('--output', help='the JSON file for the results')
+    parser.add_argument('--compare', help='a results file of another revision to compare with')
+    arguments = parser.parse_args()
+
+    results = run_benchmarks(arguments.repeat, arguments.scale, arguments.filter)
+    if arguments.output:
+        with open(arguments.output, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+    if arguments.compare:
+        with open(arguments.compare, 'r', encoding='utf-8') as file:
+            print_comparison(json.load(file), results)
+
+
+def run_benchmarks(repeat, scale=1.0, name_filter=''):
+    """
+    Runs all benchmarks on the synthetic documents and prints their results.
+
+    Documents and benchmarks that need options the measured revision does
+    not support are skipped, so older revisions can be measured as well.
+    :param repeat: the number of timed runs of every benchmark
+    :type repeat: int
+    :param scale: the factor for the number of pages
+    :type scale: float
+    :param name_filter: only the benchmarks whose name contains this text are run
+    :type name_filter: str
+    :return: the results with the revision, the environment and the benchmarks
+    :rtype: dict
+    """
+    results = OrderedDict([
+        ('revision', get_revision()),
+        ('python', platform.python_version()),
+        ('repeat', repeat),
+        ('scale', scale),
+        ('benchmarks', OrderedDict())
+    ])
+    for document, options in DOCUMENTS.items():
+        names = ['{}/{}'.format(document, benchmark) for benchmark in BENCHMARKS]
+        if not any(name_filter in name for name in names):
+            continue
+        try:
+            data = generate_document(max(1, int(options['pages'] * scale)), options['lines'],
+                                     options['object_streams'], options['compress'])
+        except Unsupported as error:
+            print('{:<32} skipped: {}'.format(document, error))
+            continue
+        for name, (setup, run) in zip(names, BENCHMARKS.values()):
+            if name_filter not in name:
+                continue
+            try:
+                result = measure(lambda: setup(data), run, repeat)
+            except Unsupported as error:
+                print('{:<32} skipped: {}'.format(name, error))
+                continue
+            result['document_size'] = len(data)
+            results['benchmarks'][name] = result
+            print('{:<32} min {:>9.2f} ms  median {:>9.2f} ms  peak {:>9.1f} KB'.format(
+                name, result['min'] * 1000, result['median'] * 1000, result['peak_memory'] / 1024))
+
+    return results
+
+
+def measure(setup, run, repeat):
+    """
+    Measures a benchmark.
+
+    The setup is not measured. The garbage collector is disabled during the
+    timed runs, the peak memory is taken in an additional run with
+    tracemalloc, because tracing slows down the allocations.
+    :param setup: callable that returns the state for a run
+    :param run: callable that is measured with the state
+    :param repeat: the number of timed runs
+    :type repeat: int
+    :return: the minimum and median time in seconds and the peak memory in bytes
+    :rtype: dict
+    """
+    times = []
+    for _ in range(repeat):
+        state = setup()
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            run(state)
+            times.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+
+    state = setup()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run(state)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return OrderedDict([
+        ('min', round(min(times), 6)),
+        ('median', round(statistics.median(times), 6)),
+        ('peak_memory', peak_memory)
+    ])
+
+
+def print_comparison(previous, current):
+    """
+    Prints the change of every benchmark against the results of another revision.
+    :param previous: the results of the other revision
+    :type previous: dict
+    :param current: the results of this revision
+    :type current: dict
+    """
+    print('{} -> {}'.format(previous.get('revision'), current.get('revision')))
+    for name, result in current['benchmarks'].items():
+        if name not in previous['benchmarks']:
+            continue
+        old = previous['benchmarks'][name]
+        print('{:<32} time {:>7.2f}x  peak {:>7.2f}x'.format(
+            name, result['min'] / old['min'] if old['min'] else float('nan'),
+            result['peak_memory'] / old['peak_memory'] if old['peak_memory'] else float('nan')))
+
+
+def get_revision():
+    """
+    Returns the git revision of the working tree or None outside of git.
+    :rtype: str
+    """
+    try:
+        output = subprocess.check_output(['git', 'describe', '--always', '--dirty'], stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode('utf-8').strip()
+
+
+def create(cls, **options):
+    """
+    Creates a writer or merger of the bundled PyPDF2 with the given options.
+    :param cls: PdfFileWriter or PdfFileMerger
+    :param options: the keyword arguments for the class
+    :raises Unsupported: if the class of the measured revision does not accept one of the options
+    """
+    parameters = inspect.signature(cls.__init__).parameters
+    unsupported = [option for option in options if option not in parameters]
+    if unsupported:
+        raise Unsupported('{} has no option {}'.format(cls.__name__, ', '.join(unsupported)))
+    return cls(**options)
+
+
+def generate_document(pages, lines, object_streams=False, compress=False):
+    """
+    Generates a PDF document that is always the same for the same arguments.
+
+    All pages share a font with an embedded font program. Every page has its
+    own content stream with the given number of text lines. The streams are
+    compressed before they are added, so only object streams need support
+    of the writer.
+    :param pages: the number of pages
+    :type pages: int
+    :param lines: the number of text lines per page
+    :type lines: int
+    :param object_streams: True for a PDF 1.5 file with object streams and a cross-reference stream
+    :type object_streams: bool
+    :param compress: True if the streams should be compressed with the default zlib level
+    :type compress: bool
+    :return: the content of the file
+    :rtype: bytes
+    :raises Unsupported: if object streams are requested and the writer cannot write them
+    """
+    writer = create(PdfFileWriter, object_streams=True) if object_streams else PdfFileWriter()
+    font_program = DecodedStreamObject()
+    font_program.setData(bytes(index * 7 % 251 for index in range(FONT_SIZE)))
+    if compress:
+        font_program = font_program.flateEncode()
+    descriptor = DictionaryObject({
+        NameObject('/Type'): NameObject('/FontDescriptor'),
+        NameObject('/FontName'): NameObject('/Synthetic'),
+        NameObject('/Flags'): NumberObject(32),
+        NameObject('/FontBBox'): ArrayObject([NumberObject(0), NumberObject(0),
+                                              NumberObject(1000), NumberObject(1000)]),
+        NameObject('/FontFile'): writer._addObject(font_program)
+    })
+    font = writer._addObject(DictionaryObject({
+        NameObject('/Type'): NameObject('/Font'),
+        NameObject('/Subtype'): NameObject('/Type1'),
+        NameObject('/BaseFont'): NameObject('/Synthetic'),
+        NameObject('/FontDescriptor'): writer._addObject(descriptor)
+    }))
+    resources = writer._addObject(DictionaryObject({
+        NameObject('/Font'): DictionaryObject({NameObject('/F1'): font})
+    }))
+
+    for page_number in range(pages):
+        contents = DecodedStreamObject()
+        contents.setData('\n'.join('BT /F1 10 Tf 72 {} Td (Line {} of page {}) Tj ET'.format(
+            760 - line % 70 * 10, line, page_number) for line in range(lines)).encode())
+        if compress:
+            contents = contents.flateEncode()
+        page = PageObject.createBlankPage(None, 595, 842)
+        page[NameObject('/Resources')] = resources
+        page[NameObject('/Contents')] = writer._addObject(contents)
+        writer.addPage(page)
+
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+def setup_read(data):
+    """Returns the document as a stream."""
+    return io.BytesIO(data)
+
+
+def run_read(stream):
+    """Parses the cross-reference table or streams and the trailer."""
+    PdfFileReader(stream, strict=False)
+
+
+def setup_reader(data):
+    """Returns a reader for the document."""
+    return PdfFileReader(io.BytesIO(data), strict=False)
+
+
+def run_get_object(reader):
+    """Resolves every object of the document."""
+    # the free entries of the cross-reference table have a higher generation
+    for idnum in reader.xref.get(0, {}):
+        reader.getObject(IndirectObject(idnum, 0, reader))
+    for idnum in reader.xref_objStm:
+        reader.getObject(IndirectObject(idnum, 0, reader))
+
+
+def run_decode(reader):
+    """Decodes the content streams of all pages."""
+    for page_number in range(reader.getNumPages()):
+        reader.getPage(page_number)['/Contents'].getObject().getData()
+
+
+def setup_append(data):
+    """Returns a reader for the document and an empty merger with the default options."""
+    return PdfFileReader(io.BytesIO(data), strict=False), PdfFileMerger(strict=False)
+
+
+def setup_append_shared(data):
+    """Returns a reader for the document and an empty copy-aware merger."""
+    return PdfFileReader(io.BytesIO(data), strict=False), create(PdfFileMerger, strict=False, share_inputs=True)
+
+
+def run_append(state):
+    """Appends several copies of the document."""
+    reader, merger = state
+    for _ in range(COPIES):
+        merger.append(reader)
+
+
+def setup_write(data):
+    """Returns a merger with the default options and several copies of the document."""
+    merger = PdfFileMerger(strict=False)
+    run_append((PdfFileReader(io.BytesIO(data), strict=False), merger))
+    return merger
+
+
+def setup_write_streaming(data):
+    """Returns a streaming merger with several copies of the document."""
+    merger = create(PdfFileMerger, strict=False, share_inputs=True, streaming=True)
+    run_append((PdfFileReader(io.BytesIO(data), strict=False), merger))
+    return merger
+
+
+def setup_write_compact(data):
+    """Returns a merger with several copies of the document and the options of merged print jobs."""
+    merger = create(PdfFileMerger, strict=False, share_inputs=True, streaming=True, dedupe=True,
+                    object_streams=True, compress_level=6, print_only=True)
+    run_append((PdfFileReader(io.BytesIO(data), strict=False), merger))
+    return merger
+
+
+def run_write(merger):
+    """Writes the merged document to memory."""
+    merger.write(io.BytesIO())
+
+
+# the benchmarks by name with their setup and the measured function
+BENCHMARKS = OrderedDict([
+    ('read', (setup_read, run_read)),
+    ('getObject', (setup_reader, run_get_object)),
+    ('decode', (setup_reader, run_decode)),
+    ('append', (setup_append, run_append)),
+    ('append-shared', (setup_append_shared, run_append)),
+    ('write', (setup_write, run_write)),
+    ('write-streaming', (setup_write_streaming, run_write)),
+    ('write-compact', (setup_write_compact, run_write))
+])
+
+
+if __name__ == '__main__':
+    main()
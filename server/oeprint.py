@@ -3,95 +3,409 @@
 """oeprint.py: The main file of the print tool"""
 
 import argparse
-import hashlib
 import json
 import os
+import subprocess
+import sys
+import time
 
-from tool.merge import merge_pdf_files
-from tool.printing import print_merged_file
+from tool.cache import get_build_name
+from tool.context import PrintContext
+from tool.daemon import forward, serve
+from tool.jobqueue import BUILDING, FAILED, SPOOLED, JobQueue
+from tool.materials import get_merge_data
+from tool.pool import get_pool_printers, split_merge_data
+from tool.printing import PrintPipe, print_files, print_merged_file, print_merged_files, submit_files
+from tool.profiling import get_profile_threshold, profiled
+from tool.timings import Timings, phase, report_timings
+from tool.watch import Prebuilder
 
 __author__ = 'Jim Martens'
 
+# commands that are executed by the daemon if it is running
+FORWARDED_COMMANDS = ['print', 'batch', 'save', 'debug']
+
+# commands that are profiled if they take longer than the threshold in data.json
+PROFILED_COMMANDS = ['print', 'print-files', 'batch']
+
 
 def main():
     """Main function for oeprint"""
     parser = argparse.ArgumentParser(description='Printing tool for Orientation Unit')
-    parser.add_argument('command', metavar='command', help='the command', choices=['print', 'save', 'debug'])
-    parser.add_argument('data', metavar='data', help='the data for the command')
+    parser.add_argument('command', metavar='command', help='the command',
+                        choices=['print', 'print-files', 'batch', 'submit', 'status', 'work', 'save', 'debug',
+                                 'cache-stats', 'serve', 'watch'])
+    parser.add_argument('data', metavar='data', help='the data for the command', nargs='?', default='')
+    parser.add_argument('--timings', action='store_true',
+                        help='write the time of every phase as JSON to stderr and to timings.log')
+    parser.add_argument('--profile', nargs='?', const='', metavar='path',
+                        help='profile the command and write the profile to path.pstats and path.alloc.txt '
+                             '(default: build/profiles)')
     arguments = parser.parse_args()
+    if arguments.command == 'batch' and not arguments.data:
+        arguments.data = sys.stdin.read()
+
+    if arguments.command == 'serve':
+        serve(PrintContext(), execute)
+        return
+    if arguments.command == 'watch':
+        Prebuilder(PrintContext()).run()
+        return
+
+    if arguments.command in FORWARDED_COMMANDS:
+        response = forward(arguments.command, arguments.data, timings=arguments.timings, profile=arguments.profile)
+        if response is not None:
+            output, status, record = response
+            sys.stdout.write(output)
+            if record is not None:
+                report_timings(record)
+            sys.exit(status)
+
+    timings = Timings(arguments.command)
+    with timings.recording():
+        with phase('start'):
+            context = PrintContext()
+            context.start_job()
+        execute(context, arguments.command, arguments.data, arguments.profile)
+    if arguments.timings:
+        report_timings(timings.get_record())
 
-    if arguments.command == 'print':
+
+def execute(context, command, data, profile=None):
+    """
+    Executes a command and profiles it if requested.
+
+    Without a requested profile the commands that print are profiled if a
+    threshold is set in data.json and the profile is kept if they take
+    longer than it.
+    :param context: the context prepared for this job
+    :type context: PrintContext
+    :param command: the command
+    :type command: str
+    :param data: the data for the command
+    :type data: str
+    :param profile: the path for the profile, an empty string for the default path or None
+    :type profile: str
+    """
+    threshold = None
+    if command in PROFILED_COMMANDS:
+        threshold = get_profile_threshold(context.get_config_data())
+    with profiled(command, profile, threshold):
+        run_command(context, command, data)
+
+
+def run_command(context, command, data):
+    """
+    Executes a command.
+    :param context: the context prepared for this job
+    :type context: PrintContext
+    :param command: the command
+    :type command: str
+    :param data: the data for the command
+    :type data: str
+    """
+    if command == 'print':
         # do printing stuff
-        print_documents(arguments.data)
-    elif arguments.command == 'save':
+        print_documents(context, data)
+    elif command == 'print-files':
+        print_file_list(context, data)
+    elif command == 'batch':
+        print_batch(context, data)
+    elif command == 'submit':
+        submit_job(data)
+    elif command == 'status':
+        print_job_status(data)
+    elif command == 'work':
+        process_jobs(context)
+    elif command == 'save':
         # do saving stuff
         pass
-    elif arguments.command == 'debug':
-        print(arguments.data)
+    elif command == 'debug':
+        print(data)
+    elif command == 'cache-stats':
+        print_cache_stats(context)
 
 
-def print_documents(data):
+def print_documents(context, data):
     """
     Manages the printing.
+    :param context: the context prepared for this job
+    :type context: PrintContext
     :param data:
     :type data: str
     """
-    hash_object = hashlib.sha256(data.encode())
-    hash_str = hash_object.hexdigest()
-    hashed_filename = hash_str + '.pdf'
-    decoded_data = json.loads(data)
+    try:
+        print_job(context, json.loads(data), on_sharded=lambda shards: print(json.dumps(shards)))
+    except FileNotFoundError as fnfe:
+        print(fnfe.strerror)
+    except ValueError as error:
+        print(error)
+
+
+def print_file_list(context, data):
+    """
+    Prints independent files and prints a JSON result record for each.
+
+    The files are passed to lpr concurrently by the number of workers set in
+    the printing section of data.json.
+    :param context: the context prepared for this job
+    :type context: PrintContext
+    :param data: JSON object with the printer and a list of files with path, prints and options
+    :type data: str
+    """
+    request = json.loads(data)
+    files = []
+    for file in request['files']:
+        files.append({
+            'path': file['path'],
+            'prints': int(file.get('prints', 1)),
+            'options': file.get('options', [])
+        })
+    print(json.dumps(submit_files(request['printer'], files, context.get_print_workers())))
+
+
+def print_batch(context, data):
+    """
+    Executes a list of print jobs and prints a JSON result record for each.
+
+    All jobs share the material index, the fingerprints and the parsed files.
+    A failing job does not stop the remaining jobs.
+    :param context: the context prepared for this batch
+    :type context: PrintContext
+    :param data: JSON list of print data objects as used by the print command
+    :type data: str
+    """
+    results = []
+    for index, job in enumerate(json.loads(data)):
+        start_time = time.time()
+        result = {
+            'job': index,
+            'printer': job.get('printer')
+        }
+        try:
+            exit_codes = print_job(context, job, on_sharded=lambda shards: result.update(shards=shards))
+        except Exception as error:
+            # the batch must continue with the next job
+            result['status'] = 'failed'
+            result['error'] = repr(error)
+        else:
+            result['status'] = 'printed' if not any(exit_codes) else 'failed'
+            result['exit_codes'] = exit_codes
+        result['duration'] = round(time.time() - start_time, 3)
+        results.append(result)
+
+    print(json.dumps(results))
+
+
+def submit_job(data):
+    """
+    Queues a print job, makes sure a worker processes it and prints its id.
+    :param data: the print data as used by the print command
+    :type data: str
+    """
+    job_id = JobQueue().submit(json.loads(data))
+    # the worker must survive the end of the ssh session
+    subprocess.Popen([sys.executable, os.path.abspath(__file__), 'work'],
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                     start_new_session=True)
+    print(job_id)
 
+
+def print_job_status(job_id):
+    """
+    Prints the status of a queued job as JSON.
+    :param job_id: the id returned by submit
+    :type job_id: str
+    """
     try:
-        filename = 'build/' + hashed_filename
-        with open(filename, 'r', encoding='utf-8'):
-            pass
-        modification_time = os.path.getmtime(filename)
-        with open('data.json', 'r', encoding='utf-8') as file:
-            config_data = json.load(file)
-            materials = config_data['materials']
-            for material in materials:
-                if material['name'] not in decoded_data['amounts']:
-                    continue
-                current_modification_time = os.path.getmtime(material['filename'])
-                if current_modification_time > modification_time:
-                    build_merged_pdf(hashed_filename, decoded_data)
-                    break
-        print_merged_file(decoded_data['printer'], 'build/' + hashed_filename)
-    except FileNotFoundError:
-        # build pdf
-        build_merged_pdf(hashed_filename, decoded_data)
-        print_merged_file(decoded_data['printer'], 'build/' + hashed_filename)
-
-
-def build_merged_pdf(filename, data):
-    with open('data.json', 'r', encoding='utf-8') as file:
-        config_data = json.load(file)
-        materials = config_data['materials']
-        processed_materials = process_materials(materials)
-        print_amounts = data['amounts']
-        
-        merge_data = []
-        for material_name in print_amounts:
-            material = processed_materials[material_name]
-            amount = print_amounts[material_name]
-            merge_data.append({
-                'material': material,
-                'amount': amount
-            })
-        
-        merge_pdf_files('build/' + filename, merge_data)
+        print(json.dumps(JobQueue().get_status(job_id), sort_keys=True))
+    except (FileNotFoundError, ValueError):
+        print('Unknown job: ' + job_id)
+
+
+def process_jobs(context):
+    """
+    Processes queued jobs until the queue is empty.
+
+    Only one worker runs at a time, further workers exit immediately.
+    :param context: the context that is shared by the jobs
+    :type context: PrintContext
+    """
+    queue = JobQueue()
+    while queue.acquire_worker_lock():
+        try:
+            queue.fail_interrupted()
+            job_ids = queue.get_queued()
+            while job_ids:
+                for job_id in job_ids:
+                    process_job(context, queue, job_id)
+                job_ids = queue.get_queued()
+            queue.remove_old_jobs()
+        finally:
+            queue.release_worker_lock()
 
+        # a job may have been submitted while the lock was released
+        if not queue.get_queued():
+            break
 
-def process_materials(materials):
-    processed_materials = {}
-    for material in materials:
-        processed_materials[material['name']] = material
-        children = material['children']
-        if children:
-            sub_materials = process_materials(children)
-            processed_materials.update(sub_materials)
 
-    return processed_materials
+def process_job(context, queue, job_id):
+    """
+    Builds and spools a queued job and records its progress.
+    :param context: the context that is shared by the jobs
+    :type context: PrintContext
+    :param queue: the job queue
+    :type queue: JobQueue
+    :param job_id: the id of the job
+    :type job_id: str
+    """
+    job = queue.get_job(job_id)
+    queue.update(job_id, BUILDING, started=time.time())
+    try:
+        context.start_job()
+        with profiled('job-' + job_id, threshold=get_profile_threshold(context.get_config_data())):
+            exit_codes = print_job(context, job['data'], lambda: queue.update(job_id, BUILDING, built=time.time()),
+                                   lambda shards: queue.update(job_id, BUILDING, shards=shards))
+    except Exception as error:
+        # the worker must continue with the next job
+        queue.update(job_id, FAILED, finished=time.time(), error=repr(error))
+        return
+
+    state = SPOOLED if not any(exit_codes) else FAILED
+    queue.update(job_id, state, finished=time.time(), exit_codes=exit_codes)
+
+
+def print_job(context, job, on_built=None, on_sharded=None):
+    """
+    Executes a single print job.
+
+    If the job contains ``"spool_copies": true`` every material is sent as
+    a single-copy segment and the spooler produces the copies. Otherwise all
+    copies are assembled from the segments into one file. An optional
+    ``"layout"`` (like ``"2-up"``) applies to all materials without their
+    own layout. If pipelining is enabled in data.json, a file that is not
+    cached yet is passed to lpr while it is assembled. With ``"pool"`` the
+    job is split among the printers of a pool instead (see print_pool_job).
+    :param context: the context prepared for this job
+    :type context: PrintContext
+    :param job: the decoded print data with amounts and printer
+    :type job: dict
+    :param on_built: optional callable that is called before the files are passed to lpr
+    :param on_sharded: optional callable that receives the shards of a pool job
+    :return: the exit codes of lpr
+    :rtype: list
+    :raises FileNotFoundError: if a material file is missing
+    :raises KeyError: if a material does not exist
+    :raises ValueError: if a layout or the printer pool does not exist
+    """
+    cache = context.get_cache()
+    segment_store = context.get_segment_store()
+    merge_data = get_merge_data(context.get_materials(), job['amounts'], job.get('layout'))
+    if job.get('pool') is not None:
+        return print_pool_job(context, job['pool'], merge_data, on_built, on_sharded)
+    if job.get('spool_copies', False):
+        return print_unit_documents(cache, segment_store, job['printer'], merge_data, on_built)
+
+    build_name = get_build_name(merge_data, context.get_fingerprints())
+    with cache.pinned(build_name, *segment_store.get_names(merge_data)):
+        pipes = []
+        open_pipe = None
+        if context.get_config_data().get('printing', {}).get('pipeline', False):
+            # a freshly built file is passed to lpr while it is written
+            def open_pipe():
+                pipes.append(PrintPipe(job['printer']))
+                return pipes[0]
+        try:
+            # build pdf from the cached segments
+            filename = segment_store.assemble(build_name, merge_data, open_pipe)
+        except BaseException:
+            for pipe in pipes:
+                pipe.abort()
+            raise
+        if on_built is not None:
+            on_built()
+        if pipes:
+            return [pipes[0].close()]
+        return [print_merged_file(job['printer'], filename)]
+
+
+def print_pool_job(context, pool, merge_data, on_built=None, on_sharded=None):
+    """
+    Splits a job at the boundaries of copies and prints the shards on all printers of a pool.
+
+    The shards have about the same number of pages and are printed at the
+    same time. Each shard is cached like a merged job of its own.
+    :param context: the context prepared for this job
+    :type context: PrintContext
+    :param pool: the name of the printer pool
+    :type pool: str
+    :param merge_data: list of dicts with material and amount
+    :type merge_data: list
+    :param on_built: optional callable that is called before the files are passed to lpr
+    :param on_sharded: optional callable that receives a list of dicts with printer,
+                       materials and pages of every shard
+    :return: the exit codes of lpr
+    :rtype: list
+    :raises ValueError: if the printer pool does not exist
+    """
+    printers = get_pool_printers(context.get_config_data(), pool)
+    cache = context.get_cache()
+    segment_store = context.get_segment_store()
+    with cache.pinned(*segment_store.get_names(merge_data)):
+        page_counts = segment_store.count_pages(segment_store.get_segments(merge_data))
+        shards = split_merge_data(merge_data, page_counts, len(printers))
+        build_names = [get_build_name(shard_data, context.get_fingerprints()) for shard_data, pages in shards]
+        with cache.pinned(*build_names):
+            filenames = []
+            for build_name, (shard_data, pages) in zip(build_names, shards):
+                filenames.append(segment_store.assemble(build_name, shard_data))
+            if on_sharded is not None:
+                on_sharded([{
+                    'printer': printer,
+                    'materials': [{'name': merge_info['material']['name'], 'amount': merge_info['amount']}
+                                  for merge_info in shard_data],
+                    'pages': pages
+                } for printer, (shard_data, pages) in zip(printers, shards)])
+            if on_built is not None:
+                on_built()
+            return print_merged_files(printers[:len(shards)], filenames)
+
+
+def print_unit_documents(cache, segment_store, printer, merge_data, on_built=None):
+    """
+    Prints every material as a segment file with the copy count passed to lpr.
+    :param cache: the build cache
+    :type cache: BuildCache
+    :param segment_store: the segment store
+    :type segment_store: SegmentStore
+    :param printer: the printer
+    :type printer: str
+    :param merge_data: list of dicts with material and amount
+    :type merge_data: list
+    :param on_built: optional callable that is called before the files are passed to lpr
+    :return: the exit codes of lpr
+    :rtype: list
+    """
+    with cache.pinned(*segment_store.get_names(merge_data)):
+        files = []
+        for segment in segment_store.get_segments(merge_data):
+            files.append({
+                'path': segment['path'],
+                'prints': segment['amount'],
+                'options': []
+            })
+        if on_built is not None:
+            on_built()
+        return print_files(printer, files)
+
+
+def print_cache_stats(context):
+    """
+    Prints the statistics of the build cache as JSON.
+    :param context: the context prepared for this job
+    :type context: PrintContext
+    """
+    print(json.dumps(context.get_cache().get_stats(), indent=2, sort_keys=True))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,138 @@
+"""test_writer.py: Provides round-trip tests for the output options of the bundled PyPDF2"""
+import io
+import itertools
+import re
+import unittest
+
+from tool.pypdf2.PyPDF2 import PdfFileMerger, PdfFileReader, PdfFileWriter
+from tool.pypdf2.PyPDF2.generic import DecodedStreamObject, DictionaryObject, IndirectObject, NameObject, \
+    readObject
+from tool.pypdf2.PyPDF2.pdf import PageObject
+
+__author__ = 'Jim Martens'
+
+PASSWORD = 'secret'
+
+
+def make_document(label, pages):
+    """
+    Returns a PDF file with the given number of pages, whose text is the label and the page number.
+
+    The font and its font program are the same in every document, so they
+    are collapsed when documents are merged with dedupe.
+    :type label: str
+    :type pages: int
+    :rtype: bytes
+    """
+    writer = PdfFileWriter()
+    font_program = DecodedStreamObject()
+    font_program.setData(b'font program ' * 100)
+    font = writer._addObject(DictionaryObject({
+        NameObject('/Type'): NameObject('/Font'),
+        NameObject('/Subtype'): NameObject('/Type1'),
+        NameObject('/BaseFont'): NameObject('/Helvetica'),
+        NameObject('/FontDescriptor'): writer._addObject(DictionaryObject({
+            NameObject('/Type'): NameObject('/FontDescriptor'),
+            NameObject('/FontFile'): writer._addObject(font_program)
+        }))
+    }))
+    for page_number in range(1, pages + 1):
+        contents = DecodedStreamObject()
+        contents.setData('BT /F1 12 Tf 72 720 Td ({} page {}) Tj ET'.format(label, page_number).encode())
+        page = PageObject.createBlankPage(None, 595, 842)
+        page[NameObject('/Resources')] = DictionaryObject({
+            NameObject('/Font'): DictionaryObject({NameObject('/F1'): font})
+        })
+        page[NameObject('/Contents')] = writer._addObject(contents)
+        writer.addPage(page)
+
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+def get_free_entries(data):
+    """
+    Returns the free entries of the last cross-reference section as a dict of object number and next free object.
+
+    Both cross-reference tables and cross-reference streams are read.
+    :type data: bytes
+    :rtype: dict
+    """
+    start = int(re.findall(br'startxref\s+(\d+)', data)[-1])
+    free = {}
+    if data[start:start + 4] == b'xref':
+        match = re.match(br'xref\s+(\d+) (\d+)\s+', data[start:])
+        first = int(match.group(1))
+        position = start + match.end()
+        for index in range(int(match.group(2))):
+            field, generation, kind = data[position + index * 20:position + index * 20 + 18].split()
+            if kind == b'f':
+                free[first + index] = int(field)
+        return free
+
+    # the cross-reference stream is never encrypted, so it is read without the reader
+    reader = PdfFileReader(io.BytesIO(data), strict=False)
+    stream = io.BytesIO(data)
+    stream.seek(start)
+    reader.readObjectHeader(stream)
+    xref = readObject(stream, reader)
+    widths = [int(width) for width in xref['/W']]
+    entries = xref.getData()
+    for number, position in enumerate(range(0, len(entries), sum(widths))):
+        fields = []
+        for width in widths:
+            fields.append(int.from_bytes(entries[position:position + width], 'big'))
+            position += width
+        if fields[0] == 0:
+            free[number] = fields[1]
+    return free
+
+
+class WriterRoundTripTest(unittest.TestCase):
+    """
+    Merges two documents with every combination of the output options and reads the result back.
+    """
+    def test_options(self):
+        inputs = [make_document('A', 3), make_document('B', 2)]
+        for streaming, dedupe, object_streams, compress, encrypt in itertools.product((False, True), repeat=5):
+            with self.subTest(streaming=streaming, dedupe=dedupe, object_streams=object_streams,
+                              compress=compress, encrypt=encrypt):
+                merger = PdfFileMerger(strict=False, streaming=streaming, dedupe=dedupe,
+                                       object_streams=object_streams, compress_level=6 if compress else None)
+                for data in inputs:
+                    merger.append(PdfFileReader(io.BytesIO(data), strict=False))
+                if encrypt:
+                    merger.output.encrypt(PASSWORD)
+                output = io.BytesIO()
+                merger.write(output)
+                data = output.getvalue()
+
+                reader = PdfFileReader(io.BytesIO(data), strict=True)
+                if encrypt:
+                    self.assertEqual(reader.decrypt(PASSWORD), 1)
+                self.assertEqual(reader.getNumPages(), 5)
+                texts = [reader.getPage(index).extractText() for index in range(5)]
+                self.assertEqual(texts, ['A page 1', 'A page 2', 'A page 3', 'B page 1', 'B page 2'])
+                for idnum in reader.xref.get(0, {}):
+                    self.assertIsNotNone(reader.getObject(IndirectObject(idnum, 0, reader)))
+                for idnum in reader.xref_objStm:
+                    self.assertIsNotNone(reader.getObject(IndirectObject(idnum, 0, reader)))
+
+                # the free objects form a list that starts at entry 0
+                free = get_free_entries(data)
+                visited = []
+                idnum = free[0]
+                while idnum != 0:
+                    visited.append(idnum)
+                    idnum = free[idnum]
+                self.assertEqual(sorted(visited), sorted(idnum for idnum in free if idnum != 0))
+                if dedupe:
+                    # the font of the second document is collapsed
+                    self.assertEqual(len(visited), 3)
+                else:
+                    self.assertEqual(visited, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
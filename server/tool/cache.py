@@ -0,0 +1,333 @@
+"""cache.py: Provides a size-bounded LRU cache for the build directory"""
+import fcntl
+import hashlib
+import json
+import os
+import time
+from contextlib import contextmanager
+
+from tool.timings import phase
+
+__author__ = 'Jim Martens'
+
+DEFAULT_MAX_SIZE = 500 * 1024 * 1024
+DEFAULT_MAX_ENTRIES = 200
+
+# must be increased whenever the merge result for the same input changes
+BUILD_FORMAT = 5
+
+
+class BuildCache:
+    """
+    Manages the generated PDF files in the build directory.
+
+    Every entry is recorded in an index file together with its size and the
+    time of its last use. When the cache grows beyond its size or entry cap
+    the least recently used entries are evicted. Entries that are pinned,
+    for example because lpr still reads them, are never evicted.
+
+    Only files that were stored through the cache are managed, other files
+    in the build directory are left alone.
+    """
+    INDEX_FILE = 'cache.json'
+    LOCK_FILE = 'cache.lock'
+
+    def __init__(self, directory='build', max_size=DEFAULT_MAX_SIZE, max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        Initializes the build cache.
+        :param directory: the build directory
+        :type directory: str
+        :param max_size: the maximum size of all entries in bytes
+        :type max_size: int
+        :param max_entries: the maximum number of entries
+        :type max_entries: int
+        """
+        self._directory = directory
+        self._maxSize = max_size
+        self._maxEntries = max_entries
+
+    @classmethod
+    def from_config(cls, config_data, directory='build'):
+        """
+        Creates the build cache from the optional build_cache section of data.json.
+        :param config_data: the decoded data.json
+        :type config_data: dict
+        :param directory: the build directory
+        :type directory: str
+        :rtype: BuildCache
+        """
+        cache_config = get_cache_config(config_data)
+        return cls(directory,
+                   int(cache_config.get('max_size', DEFAULT_MAX_SIZE)),
+                   int(cache_config.get('max_entries', DEFAULT_MAX_ENTRIES)))
+
+    def get_path(self, name):
+        """
+        Returns the path of the entry with the given name.
+        :type name: str
+        :rtype: str
+        """
+        return os.path.join(self._directory, name)
+
+    def lookup(self, name, counter=''):
+        """
+        Looks up an entry and records a hit or a miss.
+
+        The names contain the fingerprints of the sources (see
+        get_build_name), so an existing entry is always up to date.
+        :param name: the name of the entry
+        :type name: str
+        :param counter: the prefix of the hit and miss counters, so that the
+                        lookups of different kinds of entries are counted separately
+        :type counter: str
+        :return: the path of the entry or None if it must be built
+        :rtype: str
+        """
+        path = self.get_path(name)
+        with self._index() as index:
+            stats = index['stats']
+            if not os.path.exists(path):
+                stats[counter + 'misses'] = stats.get(counter + 'misses', 0) + 1
+                return None
+
+            stats[counter + 'hits'] = stats.get(counter + 'hits', 0) + 1
+            index['entries'][name] = {
+                'size': os.path.getsize(path),
+                'last_used': time.time()
+            }
+            return path
+
+    def store(self, name):
+        """
+        Registers a freshly built entry and evicts old entries if necessary.
+
+        The entry itself is never evicted by this call.
+        :param name: the name of the entry
+        :type name: str
+        """
+        with self._index() as index:
+            index['entries'][name] = {
+                'size': os.path.getsize(self.get_path(name)),
+                'last_used': time.time()
+            }
+            self._evict(index, name)
+
+    @contextmanager
+    def pinned(self, *names):
+        """
+        Pins the given entries for the duration of the with block.
+
+        Pinned entries are never evicted. Entries may be pinned before they
+        exist. The pins are released automatically if the process dies. The
+        pin file is removed on release unless another process holds a pin as
+        well, so no pin files are left for entries that were never stored.
+        :param names: the names of the entries
+        """
+        pins = []
+        try:
+            with self._locked():
+                for name in names:
+                    pin_path = self._get_pin_path(name)
+                    pin = open(pin_path, 'a')
+                    pins.append((pin, pin_path))
+                    fcntl.flock(pin, fcntl.LOCK_SH)
+            yield
+        finally:
+            with self._locked():
+                for pin, pin_path in pins:
+                    with pin:
+                        try:
+                            fcntl.flock(pin, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        except BlockingIOError:
+                            continue
+                        try:
+                            os.remove(pin_path)
+                        except FileNotFoundError:
+                            pass
+
+    def get_stats(self):
+        """
+        Returns the counters and the current state of the cache.
+        :rtype: dict
+        """
+        with self._index() as index:
+            entries = index['entries']
+            stats = dict(index['stats'])
+            stats.update({
+                'entries': len(entries),
+                'size': sum(entry['size'] for entry in entries.values()),
+                'max_entries': self._maxEntries,
+                'max_size': self._maxSize
+            })
+            return stats
+
+    def _evict(self, index, protected):
+        """
+        Evicts the least recently used entries until the cache fits its limits.
+        :param index: the locked index
+        :type index: dict
+        :param protected: the name of an entry that must not be evicted
+        :type protected: str
+        """
+        entries = index['entries']
+        size = sum(entry['size'] for entry in entries.values())
+        for name in sorted(entries, key=lambda entry_name: entries[entry_name]['last_used']):
+            if size <= self._maxSize and len(entries) <= self._maxEntries:
+                break
+            if name == protected or self._is_pinned(name):
+                continue
+
+            try:
+                os.remove(self.get_path(name))
+            except FileNotFoundError:
+                pass
+            else:
+                index['stats']['evictions'] += 1
+            size -= entries[name]['size']
+            del entries[name]
+
+    def _is_pinned(self, name):
+        """
+        Checks whether any process holds a pin on the entry. Must be called
+        with the index lock held, so no new pin can be taken meanwhile.
+        :type name: str
+        :rtype: bool
+        """
+        pin_path = self._get_pin_path(name)
+        try:
+            pin = open(pin_path, 'r')
+        except FileNotFoundError:
+            return False
+
+        with pin:
+            try:
+                fcntl.flock(pin, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            os.remove(pin_path)
+            return False
+
+    def _get_pin_path(self, name):
+        return self.get_path(name) + '.pin'
+
+    @contextmanager
+    def _locked(self):
+        """
+        Holds the lock of the index for the duration of the with block.
+        """
+        with open(os.path.join(self._directory, self.LOCK_FILE), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    @contextmanager
+    def _index(self):
+        """
+        Locks, loads and afterwards saves the index.
+        """
+        with self._locked():
+            index_path = os.path.join(self._directory, self.INDEX_FILE)
+            try:
+                with open(index_path, 'r', encoding='utf-8') as file:
+                    index = json.load(file)
+            except (FileNotFoundError, ValueError):
+                index = {
+                    'entries': {},
+                    'stats': {'hits': 0, 'misses': 0, 'segment_hits': 0, 'segment_misses': 0, 'evictions': 0}
+                }
+
+            yield index
+
+            with open(index_path + '.tmp', 'w', encoding='utf-8') as file:
+                json.dump(index, file)
+            os.replace(index_path + '.tmp', index_path)
+
+
+class MaterialFingerprints:
+    """
+    Computes and memoizes the fingerprints of material files.
+
+    A fingerprint consists of the size and the modification time of a file.
+    If content hashing is enabled the modification time is replaced by the
+    SHA-256 of the content, so touching a file does not invalidate builds.
+    Every file is only inspected once per instance.
+    """
+    def __init__(self, content_hash=False):
+        """
+        Initializes the fingerprints.
+        :param content_hash: True if the content of the files should be hashed
+        :type content_hash: bool
+        """
+        self._contentHash = content_hash
+        self._fingerprints = {}
+
+    @classmethod
+    def from_config(cls, config_data):
+        """
+        Creates the fingerprints from the optional build_cache section of data.json.
+        :param config_data: the decoded data.json
+        :type config_data: dict
+        :rtype: MaterialFingerprints
+        """
+        return cls(bool(get_cache_config(config_data).get('content_hash', False)))
+
+    def get(self, filename):
+        """
+        Returns the fingerprint of the given file.
+        :type filename: str
+        :rtype: list
+        :raises FileNotFoundError: if the file does not exist
+        """
+        if filename not in self._fingerprints:
+            with phase('fingerprints'):
+                stat = os.stat(filename)
+                if self._contentHash:
+                    hash_object = hashlib.sha256()
+                    with open(filename, 'rb') as file:
+                        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+                            hash_object.update(chunk)
+                    self._fingerprints[filename] = [stat.st_size, hash_object.hexdigest()]
+                else:
+                    self._fingerprints[filename] = [stat.st_size, stat.st_mtime_ns]
+
+        return self._fingerprints[filename]
+
+
+def get_build_name(merge_data, fingerprints, prefix=''):
+    """
+    Returns the cache name for the result of merging the given merge data.
+
+    The name only depends on the canonical form of the merge data (the
+    files, pages, layouts and amounts) and the fingerprints of the used
+    files. Material names and the printer are not part of it, so equivalent
+    requests share the same build.
+    :param merge_data: list of dicts with material and amount
+    :type merge_data: list
+    :param fingerprints: the fingerprints of the material files
+    :type fingerprints: MaterialFingerprints
+    :param prefix: a prefix for the name
+    :type prefix: str
+    :rtype: str
+    """
+    canonical_data = [BUILD_FORMAT]
+    for merge_info in merge_data:
+        material = merge_info['material']
+        canonical_data.append([
+            material['filename'],
+            material.get('pages'),
+            material.get('layout', '1-up'),
+            int(merge_info['amount']),
+            fingerprints.get(material['filename'])
+        ])
+
+    canonical_json = json.dumps(canonical_data, separators=(',', ':'))
+    return prefix + hashlib.sha256(canonical_json.encode()).hexdigest() + '.pdf'
+
+
+def get_cache_config(config_data):
+    """
+    Returns the build_cache section of data.json.
+    :param config_data: the decoded data.json
+    :type config_data: dict
+    :rtype: dict
+    """
+    return config_data.get('build_cache', {})
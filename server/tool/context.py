@@ -0,0 +1,114 @@
+"""context.py: Provides the state shared by the commands of oeprint"""
+import json
+import os
+
+from tool.cache import BuildCache, MaterialFingerprints
+from tool.materials import load_material_index
+from tool.merge import ReaderCache
+from tool.printing import DEFAULT_PRINT_WORKERS
+from tool.timings import phase
+from tool.segments import SegmentStore
+
+__author__ = 'Jim Martens'
+
+DEFAULT_COMPRESS_LEVEL = 6
+
+
+class PrintContext:
+    """
+    Holds the state of oeprint that can be reused between jobs.
+
+    A command line call uses a context for a single job. The daemon keeps one
+    context alive, so the material index and the parsed PDF files stay warm
+    and data.json is only loaded again after it has changed.
+    """
+    def __init__(self, data_file='data.json', build_directory='build'):
+        """
+        Initializes the context.
+        :param data_file: the path of data.json
+        :type data_file: str
+        :param build_directory: the build directory
+        :type build_directory: str
+        """
+        self._dataFile = data_file
+        self._buildDirectory = build_directory
+        self._dataModificationTime = None
+        self._configData = None  # type: dict
+        self._materials = None  # type: OrderedDict
+        self._readers = ReaderCache()
+        self._fingerprints = None  # type: MaterialFingerprints
+
+    def start_job(self):
+        """
+        Prepares the context for the next job.
+
+        Loads data.json if it has changed since the last job and forgets the
+        fingerprints of the material files, which are only valid for one job.
+        The readers of removed or changed files are dropped.
+        """
+        modification_time = os.stat(self._dataFile).st_mtime_ns
+        if modification_time != self._dataModificationTime:
+            with phase('config'):
+                with open(self._dataFile, 'r', encoding='utf-8') as file:
+                    self._configData = json.load(file)
+                self._materials = load_material_index(self._dataFile)
+            self._dataModificationTime = modification_time
+
+        self._fingerprints = MaterialFingerprints.from_config(self._configData)
+        self._readers.prune()
+
+    def get_config_data(self):
+        """
+        Returns the decoded data.json.
+        :rtype: dict
+        """
+        return self._configData
+
+    def get_materials(self):
+        """
+        Returns all materials including the children by name in data.json order.
+        :rtype: OrderedDict
+        """
+        return self._materials
+
+    def get_fingerprints(self):
+        """
+        Returns the fingerprints of the material files for the current job.
+        :rtype: MaterialFingerprints
+        """
+        return self._fingerprints
+
+    def get_readers(self):
+        """
+        Returns the reader cache.
+        :rtype: ReaderCache
+        """
+        return self._readers
+
+    def get_cache(self):
+        """
+        Returns the build cache.
+        :rtype: BuildCache
+        """
+        return BuildCache.from_config(self._configData, self._buildDirectory)
+
+    def get_segment_store(self):
+        """
+        Returns the segment store for the current job.
+        :rtype: SegmentStore
+        """
+        build_config = self._configData.get('build', {})
+        workers = int(build_config.get('workers', 1))
+        if workers == 0:
+            workers = os.cpu_count() or 1
+        compress_level = build_config.get('compress_level', DEFAULT_COMPRESS_LEVEL)
+        if compress_level is not None:
+            compress_level = int(compress_level)
+        return SegmentStore(self.get_cache(), self._fingerprints, self._readers, workers, compress_level)
+
+    def get_print_workers(self):
+        """
+        Returns the number of files that are passed to lpr at the same time.
+        :rtype: int
+        """
+        return max(1, int(self._configData.get('printing', {}).get('workers', DEFAULT_PRINT_WORKERS)))
@@ -0,0 +1,158 @@
+"""daemon.py: Provides the oeprint daemon and the forwarding of commands to it"""
+import io
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import tempfile
+import traceback
+from contextlib import contextmanager, redirect_stdout
+
+from tool.timings import Timings
+
+__author__ = 'Jim Martens'
+
+SOCKET_FILE = 'oeprint.sock'
+
+
+class _CommandHandler(socketserver.StreamRequestHandler):
+    """
+    Executes one forwarded command and sends back its output and its error output.
+    """
+    def handle(self):
+        request = json.loads(self.rfile.readline().decode('utf-8'))
+        output = io.StringIO()
+        errors = []
+        status = 0
+        timings = Timings(request['command'])
+        with redirect_stdout(output), captured_stderr(errors), timings.recording():
+            try:
+                self.server.context.start_job()
+                self.server.run_command(self.server.context, request['command'], request['data'],
+                                        request.get('profile'))
+            except Exception:
+                traceback.print_exc()
+                status = 1
+
+        response = {
+            'output': output.getvalue(),
+            'errors': errors[0],
+            'status': status,
+            'timings': timings.get_record() if request.get('timings', False) else None
+        }
+        self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+
+@contextmanager
+def captured_stderr(errors):
+    """
+    Captures everything that is written to the standard error of this process in the with block.
+
+    The file descriptor is redirected, so the error output of child
+    processes like lpr is captured as well. The daemon executes one command
+    at a time, so no other output is captured by mistake.
+    :param errors: list that receives the captured text
+    :type errors: list
+    """
+    with tempfile.TemporaryFile() as file:
+        sys.stderr.flush()
+        saved = os.dup(2)
+        os.dup2(file.fileno(), 2)
+        try:
+            yield
+        finally:
+            sys.stderr.flush()
+            os.dup2(saved, 2)
+            os.close(saved)
+            file.seek(0)
+            errors.append(file.read().decode('utf-8', 'replace'))
+
+
+def serve(context, run_command, socket_path=SOCKET_FILE):
+    """
+    Runs the daemon until it is interrupted or terminated.
+
+    The commands are executed one after another with the same context.
+    :param context: the context that is kept between the jobs
+    :type context: PrintContext
+    :param run_command: callable that executes a command with context, command, data and profile path
+    :param socket_path: the path of the Unix socket
+    :type socket_path: str
+    """
+    if os.path.exists(socket_path):
+        client = _connect(socket_path)
+        if client is not None:
+            client.close()
+            print('oeprint daemon is already running')
+            return
+        # left over by a daemon that was killed
+        os.remove(socket_path)
+
+    server = socketserver.UnixStreamServer(socket_path, _CommandHandler)
+    server.context = context
+    server.run_command = run_command
+    os.chmod(socket_path, 0o600)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+
+
+def forward(command, data, socket_path=SOCKET_FILE, timings=False, profile=None):
+    """
+    Forwards a command to the running daemon.
+
+    The error output of the command is written to the standard error.
+    :param command: the command
+    :type command: str
+    :param data: the data for the command
+    :type data: str
+    :param socket_path: the path of the Unix socket
+    :type socket_path: str
+    :param timings: True if the daemon should return the timings of the command
+    :type timings: bool
+    :param profile: the path for a profile of the command, an empty string for the default path or None
+    :type profile: str
+    :return: the output, the exit status and the timings of the command or None if no daemon is running
+    :rtype: tuple
+    """
+    client = _connect(socket_path)
+    if client is None:
+        return None
+
+    request = {
+        'command': command,
+        'data': data,
+        'timings': timings,
+        'profile': profile
+    }
+    with client:
+        client.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        with client.makefile('rb') as file:
+            response = json.loads(file.readline().decode('utf-8'))
+
+    sys.stderr.write(response.get('errors', ''))
+    return response['output'], response['status'], response.get('timings')
+
+
+def _connect(socket_path):
+    """
+    Connects to the daemon.
+    :type socket_path: str
+    :return: the connected socket or None if no daemon is listening
+    :rtype: socket.socket
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        client.close()
+        return None
+
+    return client
@@ -0,0 +1,187 @@
+"""imposition.py: Provides the placement of several pages on one sheet"""
+from tool.pypdf2.PyPDF2.generic import DecodedStreamObject, DictionaryObject, NameObject
+from tool.pypdf2.PyPDF2.pdf import PageObject
+
+__author__ = 'Jim Martens'
+
+# columns and rows of every layout and whether the sheet is turned against the pages
+LAYOUTS = {
+    '1-up': (1, 1, False),
+    '2-up': (2, 1, True),
+    '4-up': (2, 2, False),
+    'booklet': (2, 1, True)
+}
+
+# the transformation matrices that undo the rotation of a page with the given size
+ROTATIONS = {
+    0: lambda width, height: (1, 0, 0, 1, 0, 0),
+    90: lambda width, height: (0, -1, 1, 0, 0, width),
+    180: lambda width, height: (-1, 0, 0, -1, width, height),
+    270: lambda width, height: (0, 1, -1, 0, height, 0)
+}
+
+
+class Imposer:
+    """
+    Places the pages of materials on sheets.
+
+    Every source page is added to the output as a Form XObject only once. The
+    sheets draw these XObjects with a transformation, so the content streams
+    of the pages are neither parsed nor copied, no matter how many sheets and
+    copies show a page.
+    """
+    def __init__(self, merger):
+        """
+        Initializes the imposer.
+        :param merger: the merger that receives the sheets
+        :type merger: PdfFileMerger
+        """
+        self._merger = merger
+        self._formXObjects = {}
+
+    def impose(self, pages, layout):
+        """
+        Places the given pages on sheets.
+
+        The sheets have the size of the first page, turned if the layout
+        requires it. Every page is scaled to fit its cell and centered in it.
+        :param pages: the pages in reading order
+        :type pages: list
+        :param layout: the name of the layout
+        :type layout: str
+        :return: the sheets, which may be appended several times
+        :rtype: list
+        :raises ValueError: if the layout does not exist
+        """
+        columns, rows, turned = get_layout(layout)
+        width, height = get_display_size(pages[0])
+        if turned:
+            width, height = height, width
+        cell_width = width / columns
+        cell_height = height / rows
+        if layout == 'booklet':
+            order = get_booklet_order(len(pages))
+        else:
+            order = list(range(len(pages)))
+
+        sheets = []
+        for start in range(0, len(order), columns * rows):
+            xobjects = DictionaryObject()
+            operations = []
+            for cell, index in enumerate(order[start:start + columns * rows]):
+                if index is None:
+                    # blank page of a booklet
+                    continue
+                name = NameObject('/P{}'.format(cell))
+                xobjects[name] = self._get_form_xobject(pages[index])
+                matrix = get_placement(pages[index],
+                                       (cell % columns) * cell_width,
+                                       height - (cell // columns + 1) * cell_height,
+                                       cell_width, cell_height)
+                operations.append('q {} cm {} Do Q'.format(' '.join('{:.4f}'.format(value) for value in matrix),
+                                                           name))
+
+            contents = DecodedStreamObject()
+            contents.setData('\n'.join(operations).encode())
+            sheet = PageObject.createBlankPage(None, width, height)
+            sheet[NameObject('/Resources')] = DictionaryObject({NameObject('/XObject'): xobjects})
+            sheet[NameObject('/Contents')] = self._merger.addObject(contents)
+            sheets.append(sheet)
+
+        return sheets
+
+    def _get_form_xobject(self, page):
+        """
+        Returns the reference to the Form XObject of a page and adds it to the output if necessary.
+        :type page: PageObject
+        :rtype: IndirectObject
+        """
+        if id(page) not in self._formXObjects:
+            # the page is kept, so its id cannot be reused by another page
+            self._formXObjects[id(page)] = (page, self._merger.addObject(page.createFormXObject()))
+        return self._formXObjects[id(page)][1]
+
+
+def get_layout(layout):
+    """
+    Returns the columns and rows of a layout and whether the sheet is turned.
+    :param layout: the name of the layout
+    :type layout: str
+    :rtype: tuple
+    :raises ValueError: if the layout does not exist
+    """
+    if layout not in LAYOUTS:
+        raise ValueError('Unknown layout: ' + str(layout))
+    return LAYOUTS[layout]
+
+
+def get_rotation(page):
+    """
+    Returns the rotation of a page in degrees between 0 and 270.
+    :type page: PageObject
+    :rtype: int
+    """
+    return int(page.get('/Rotate', 0)) % 360
+
+
+def get_display_size(page):
+    """
+    Returns the size of a page as it is displayed, i.e. with its rotation.
+    :type page: PageObject
+    :return: the width and height
+    :rtype: tuple
+    """
+    width = float(page.cropBox.getWidth())
+    height = float(page.cropBox.getHeight())
+    if get_rotation(page) in (90, 270):
+        return height, width
+    return width, height
+
+
+def get_placement(page, x, y, width, height):
+    """
+    Returns the transformation matrix that fits a page into a cell of a sheet.
+    :param page: the page
+    :type page: PageObject
+    :param x: the left edge of the cell
+    :type x: float
+    :param y: the bottom edge of the cell
+    :type y: float
+    :param width: the width of the cell
+    :type width: float
+    :param height: the height of the cell
+    :type height: float
+    :rtype: list
+    """
+    left = float(page.cropBox.getLowerLeft_x())
+    bottom = float(page.cropBox.getLowerLeft_y())
+    a, b, c, d, e, f = ROTATIONS[get_rotation(page)](float(page.cropBox.getWidth()),
+                                                     float(page.cropBox.getHeight()))
+    display_width, display_height = get_display_size(page)
+    scale = min(width / display_width, height / display_height)
+    return [
+        scale * a,
+        scale * b,
+        scale * c,
+        scale * d,
+        scale * (e - a * left - c * bottom) + x + (width - display_width * scale) / 2,
+        scale * (f - b * left - d * bottom) + y + (height - display_height * scale) / 2
+    ]
+
+
+def get_booklet_order(number_of_pages):
+    """
+    Returns the order of the pages on the sheet sides of a saddle-stitched booklet.
+
+    The number of pages is rounded up to a multiple of four, the missing
+    pages are None.
+    :param number_of_pages: the number of pages of the material
+    :type number_of_pages: int
+    :return: the page indices for the left and right cell of every sheet side
+    :rtype: list
+    """
+    total = -(-number_of_pages // 4) * 4
+    order = []
+    for sheet in range(total // 4):
+        order.extend([total - 1 - 2 * sheet, 2 * sheet, 2 * sheet + 1, total - 2 - 2 * sheet])
+    return [index if index < number_of_pages else None for index in order]
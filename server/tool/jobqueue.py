@@ -0,0 +1,192 @@
+"""jobqueue.py: Provides an on-disk queue for print jobs"""
+import fcntl
+import json
+import os
+import time
+import uuid
+
+__author__ = 'Jim Martens'
+
+QUEUED = 'queued'
+BUILDING = 'building'
+SPOOLED = 'spooled'
+FAILED = 'failed'
+
+# finished jobs are removed after a week
+MAX_AGE = 7 * 24 * 60 * 60
+
+
+class JobQueue:
+    """
+    Stores print jobs as JSON files in the jobs directory.
+
+    Every job moves from queued over building to spooled or failed. The
+    timestamps of these transitions are stored in the job record. The jobs
+    are processed by a single worker in the order of their submission.
+    """
+    WORKER_LOCK_FILE = 'worker.lock'
+
+    def __init__(self, directory='jobs'):
+        """
+        Initializes the job queue.
+        :param directory: the directory for the job files
+        :type directory: str
+        """
+        self._directory = directory
+        self._workerLock = None
+        os.makedirs(directory, exist_ok=True)
+
+    def submit(self, data):
+        """
+        Adds a print job to the queue.
+        :param data: the decoded print data
+        :type data: dict
+        :return: the id of the job
+        :rtype: str
+        """
+        job_id = time.strftime('%Y%m%d%H%M%S') + '-' + uuid.uuid4().hex[:8]
+        self._write({
+            'id': job_id,
+            'state': QUEUED,
+            'data': data,
+            'submitted': time.time()
+        })
+        return job_id
+
+    def get_job(self, job_id):
+        """
+        Returns the record of a job.
+        :param job_id: the id of the job
+        :type job_id: str
+        :rtype: dict
+        :raises FileNotFoundError: if the job does not exist
+        :raises ValueError: if the job id is invalid
+        """
+        with open(self._get_path(job_id), 'r', encoding='utf-8') as file:
+            return json.load(file)
+
+    def get_status(self, job_id):
+        """
+        Returns the status of a job without its print data.
+
+        The durations are added for every finished phase.
+        :param job_id: the id of the job
+        :type job_id: str
+        :rtype: dict
+        :raises FileNotFoundError: if the job does not exist
+        :raises ValueError: if the job id is invalid
+        """
+        status = self.get_job(job_id)
+        del status['data']
+        phases = [
+            ('queue_time', 'submitted', 'started'),
+            ('build_time', 'started', 'built'),
+            ('spool_time', 'built', 'finished'),
+            ('total_time', 'submitted', 'finished')
+        ]
+        for duration, start, end in phases:
+            if start in status and end in status:
+                status[duration] = round(status[end] - status[start], 3)
+        return status
+
+    def update(self, job_id, state, **fields):
+        """
+        Changes the state of a job and stores additional fields.
+        :param job_id: the id of the job
+        :type job_id: str
+        :param state: the new state
+        :type state: str
+        """
+        job = self.get_job(job_id)
+        job['state'] = state
+        job.update(fields)
+        self._write(job)
+
+    def get_queued(self):
+        """
+        Returns the ids of all queued jobs in the order of submission.
+        :rtype: list
+        """
+        jobs = []
+        for filename in os.listdir(self._directory):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                job = self.get_job(filename[:-len('.json')])
+            except (FileNotFoundError, ValueError):
+                continue
+            if job['state'] == QUEUED:
+                jobs.append((job['submitted'], job['id']))
+
+        return [job_id for submitted, job_id in sorted(jobs)]
+
+    def fail_interrupted(self):
+        """
+        Marks the jobs that a previous worker left in the building state as failed.
+
+        Must only be called by the worker while it holds the worker lock.
+        """
+        for filename in os.listdir(self._directory):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                job = self.get_job(filename[:-len('.json')])
+            except (FileNotFoundError, ValueError):
+                continue
+            if job['state'] == BUILDING:
+                self.update(job['id'], FAILED, finished=time.time(), error='worker was interrupted')
+
+    def acquire_worker_lock(self):
+        """
+        Makes this process the worker of the queue.
+        :return: True if no other worker is running, False otherwise
+        :rtype: bool
+        """
+        lock = open(os.path.join(self._directory, self.WORKER_LOCK_FILE), 'a')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return False
+
+        self._workerLock = lock
+        return True
+
+    def release_worker_lock(self):
+        """
+        Allows other processes to become the worker of the queue.
+        """
+        if self._workerLock is not None:
+            self._workerLock.close()
+            self._workerLock = None
+
+    def remove_old_jobs(self, max_age=MAX_AGE):
+        """
+        Removes finished jobs that were submitted more than max_age seconds ago.
+        :param max_age: the maximum age in seconds
+        :type max_age: int
+        """
+        for filename in os.listdir(self._directory):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                job = self.get_job(filename[:-len('.json')])
+            except (FileNotFoundError, ValueError):
+                continue
+            if job['state'] in (SPOOLED, FAILED) and job['submitted'] < time.time() - max_age:
+                os.remove(os.path.join(self._directory, filename))
+
+    def _get_path(self, job_id):
+        if os.sep in job_id or job_id.startswith('.'):
+            raise ValueError('Invalid job id: ' + job_id)
+        return os.path.join(self._directory, job_id + '.json')
+
+    def _write(self, job):
+        """
+        Writes the record of a job atomically.
+        :type job: dict
+        """
+        path = self._get_path(job['id'])
+        with open(path + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump(job, file)
+        os.replace(path + '.tmp', path)
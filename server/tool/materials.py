@@ -0,0 +1,169 @@
+"""materials.py: Provides functionality to look up the materials of data.json"""
+import json
+import os
+from collections import OrderedDict
+
+from tool.imposition import get_layout
+from tool.merge import determine_ranges
+
+__author__ = 'Jim Martens'
+
+# must be increased whenever the layout of the material index changes
+INDEX_FORMAT = 2
+
+
+def process_materials(materials, parent=None):
+    """
+    Flattens the material tree of data.json.
+
+    Every material is returned without its nested children. Instead the
+    names of the children and the name of the parent are recorded, and for
+    materials with selected pages the page ranges are computed in advance.
+    The optional layout of a material (see tool.imposition) is kept.
+    :param materials: the materials list of data.json
+    :type materials: list
+    :param parent: the name of the parent material
+    :type parent: str
+    :return: the materials by name in data.json order
+    :rtype: OrderedDict
+    """
+    processed_materials = OrderedDict()
+    for material in materials:
+        entry = {
+            'name': material['name'],
+            'filename': material['filename'],
+            'parent': parent,
+            'children': [child['name'] for child in material['children']]
+        }
+        if 'pages' in material:
+            entry['pages'] = material['pages']
+            entry['ranges'] = [list(page_range) for page_range in determine_ranges(material['pages'])]
+        if 'layout' in material:
+            entry['layout'] = material['layout']
+        processed_materials[material['name']] = entry
+        if material['children']:
+            processed_materials.update(process_materials(material['children'], material['name']))
+
+    return processed_materials
+
+
+def load_material_index(data_file):
+    """
+    Returns the flattened materials of data.json from its index file.
+
+    The index is stored next to data.json (data.index.json for data.json)
+    and records the size and modification time of data.json. It is compiled
+    again only if data.json has changed. If the index cannot be written the
+    compiled materials are used anyway.
+    :param data_file: the path of data.json
+    :type data_file: str
+    :return: the materials by name in data.json order
+    :rtype: OrderedDict
+    """
+    stat = os.stat(data_file)
+    index_file = get_index_file(data_file)
+    try:
+        with open(index_file, 'r', encoding='utf-8') as file:
+            index = json.load(file, object_pairs_hook=OrderedDict)
+        if index['source'] == [INDEX_FORMAT, stat.st_size, stat.st_mtime_ns]:
+            return index['materials']
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    with open(data_file, 'r', encoding='utf-8') as file:
+        stat = os.fstat(file.fileno())
+        materials = process_materials(json.load(file)['materials'])
+    try:
+        with open(index_file + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump({
+                'source': [INDEX_FORMAT, stat.st_size, stat.st_mtime_ns],
+                'materials': materials
+            }, file)
+        os.replace(index_file + '.tmp', index_file)
+    except OSError:
+        pass
+
+    return materials
+
+
+def get_index_file(data_file):
+    """
+    Returns the path of the index file for the given data.json.
+    :param data_file: the path of data.json
+    :type data_file: str
+    :rtype: str
+    """
+    root, extension = os.path.splitext(data_file)
+    return root + '.index' + extension
+
+
+def get_merge_data(processed_materials, print_amounts, layout=None):
+    """
+    Returns the merge data for the given print amounts.
+
+    The materials are ordered like in data.json and materials without a
+    positive amount are left out, so the merge data of equivalent requests
+    is identical regardless of the order of the print amounts.
+    :param processed_materials: the materials by name as returned by process_materials
+    :type processed_materials: OrderedDict
+    :param print_amounts: the print amount for each material name
+    :type print_amounts: dict
+    :param layout: the layout for the materials that do not have their own layout
+    :type layout: str
+    :rtype: list
+    :raises KeyError: if a material does not exist
+    :raises ValueError: if a layout does not exist
+    """
+    for material_name in print_amounts:
+        if material_name not in processed_materials:
+            raise KeyError(material_name)
+
+    merge_data = []
+    for material_name, material in processed_materials.items():
+        amount = int(print_amounts.get(material_name, 0))
+        if amount < 1:
+            continue
+        if layout is not None and 'layout' not in material:
+            material = dict(material, layout=layout)
+        get_layout(material.get('layout', '1-up'))
+        merge_data.append({
+            'material': material,
+            'amount': amount
+        })
+
+    return merge_data
+
+
+def get_configuration_amounts(configurations, name, path=()):
+    """
+    Returns the print amounts of a saved configuration of data.json.
+
+    The amounts of the sub configurations are multiplied with their amount
+    and added, like the client does when it prints a configuration.
+    :param configurations: the configurations list of data.json
+    :type configurations: list
+    :param name: the name of the configuration
+    :type name: str
+    :param path: the names of the configurations that contain this one
+    :type path: tuple
+    :return: the print amount for each material name
+    :rtype: dict
+    :raises KeyError: if a configuration does not exist
+    :raises ValueError: if a configuration contains itself
+    """
+    if name in path:
+        raise ValueError('Configuration contains itself: ' + name)
+    configuration = next((entry for entry in configurations if entry['name'] == name), None)
+    if configuration is None:
+        raise KeyError(name)
+
+    print_amounts = {}
+    for material in configuration['materials']:
+        print_amounts[material['name']] = print_amounts.get(material['name'], 0) + int(material['amount'])
+    for sub_configuration in configuration['configurations']:
+        sub_amounts = get_configuration_amounts(configurations, sub_configuration['name'], path + (name,))
+        for material_name, amount in sub_amounts.items():
+            print_amounts[material_name] = (print_amounts.get(material_name, 0)
+                                            + int(sub_configuration['amount']) * amount)
+
+    return print_amounts
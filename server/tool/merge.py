@@ -1,45 +1,261 @@
 """merge.py: Provides functionality to merge PDF files"""
 import itertools
+import os
+from collections import OrderedDict
 
+from tool.imposition import Imposer
 from tool.pypdf2.PyPDF2 import PdfFileReader, PdfFileMerger
+from tool.timings import count, phase
 
 __author__ = 'Jim Martens'
 
+# the streams of a merge are compressed by a few threads
+COMPRESS_THREADS = min(4, os.cpu_count() or 1)
 
-def merge_pdf_files(filename, merge_data):
-    merger = PdfFileMerger(strict=False)
+
+class ReaderCache:
+    """
+    Keeps parsed PDF files for reuse in later merges.
+
+    The cache hands out views of its readers (see PdfFileReader.createView),
+    so a merge never modifies a cached reader. The files are read on demand
+    instead of being loaded into memory. A file is parsed again when its
+    size or modification time changes. Only the most recently used readers
+    are kept. The file of a reader is closed when the reader is dropped, so
+    a removed file, for example an evicted segment, does not keep its disk
+    space in use.
+    """
+    def __init__(self, max_readers=64):
+        """
+        Initializes the reader cache.
+        :param max_readers: the maximum number of cached readers
+        :type max_readers: int
+        """
+        self._maxReaders = max_readers
+        self._readers = OrderedDict()
+
+    def get(self, filename):
+        """
+        Returns a reader for the given file.
+        :type filename: str
+        :rtype: PdfFileReader
+        :raises FileNotFoundError: if the file does not exist
+        """
+        fingerprint = get_file_fingerprint(filename)
+        cached = self._readers.pop(filename, None)
+        if cached is not None and cached[0] != fingerprint:
+            cached[1].stream.close()
+            cached = None
+        if fingerprint is None:
+            raise FileNotFoundError(2, 'No such file or directory', filename)
+
+        if cached is None:
+            with phase('parse'):
+                cached = (fingerprint, PdfFileReader(open(filename, 'rb'), strict=False))
+            count('parsed_files')
+        self._readers[filename] = cached
+        while len(self._readers) > self._maxReaders:
+            self._readers.popitem(last=False)[1][1].stream.close()
+
+        return cached[1].createView()
+
+    def prune(self):
+        """
+        Drops the readers whose file was removed or changed and closes their files.
+
+        Must not be called while views of the readers are still in use.
+        """
+        for filename, (fingerprint, reader) in list(self._readers.items()):
+            if get_file_fingerprint(filename) != fingerprint:
+                del self._readers[filename]
+                reader.stream.close()
+
+
+class TeeStream:
+    """
+    Writes to a file and copies everything to a second stream.
+
+    The position of the stream is the one of the file, so the second stream
+    does not need to support tell.
+    """
+    def __init__(self, file, copy_stream):
+        """
+        Initializes the stream.
+        :param file: the file
+        :param copy_stream: the stream that receives the copy
+        """
+        self._file = file
+        self._copyStream = copy_stream
+
+    def write(self, data):
+        """
+        Writes data to both streams.
+        :type data: bytes
+        """
+        self._file.write(data)
+        self._copyStream.write(data)
+
+    def tell(self):
+        """
+        Returns the position in the file.
+        :rtype: int
+        """
+        return self._file.tell()
+
+
+def get_file_fingerprint(filename):
+    """
+    Returns the size and the modification time of a file.
+    :type filename: str
+    :return: the fingerprint or None if the file does not exist
+    :rtype: tuple
+    """
     try:
-        for merge_info in merge_data:
-            material = merge_info['material']
-            page_ranges = None # type: list
-            add_empty_page = False
-            pdf_file = PdfFileReader(material['filename'], strict=False)
-            if 'pages' in material:
-                pages = material['pages']
-                page_ranges = list(determine_ranges(pages))
-                if len(pages) % 2 != 0:
-                    add_empty_page = True
-            else:
-                if pdf_file.getNumPages() % 2 != 0:
-                    # the pdf file has an odd number of pages
-                    add_empty_page = True
-    
-            for x in range(int(merge_info['amount'])):  # print material x amount of times
-                if page_ranges is not None:
-                    for start, stop in page_ranges:
-                        merger.append(pdf_file, pages=(start - 1, stop - 1))
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def merge_pdf_files(filename, merge_data, readers=None, compress_level=None):
+    """
+    Merges the given materials into one PDF file.
+
+    The merge is copy-aware: every source file is parsed only once and all
+    copies of a page share the content streams and resources of the source.
+    The size of the result therefore grows with the number of distinct
+    materials and not with the total number of copies. The output is written
+    page by page, so the memory needed stays bounded by the largest page.
+
+    Materials with a layout other than 1-up are imposed on sheets first
+    (see Imposer), all copies share the same sheets. The merge is print-only,
+    so outlines, named destinations and the annotations that are not printed
+    are left out.
+    :param filename: the path of the merged PDF file
+    :type filename: str
+    :param merge_data: list of dicts with material and amount
+    :type merge_data: list
+    :param readers: the reader cache to take the source files from
+    :type readers: ReaderCache
+    :param compress_level: the zlib level for the streams without a filter or None
+    :type compress_level: int
+    """
+    merger = PdfFileMerger(strict=False, share_inputs=True, streaming=True, dedupe=True,
+                           compress_level=compress_level, compress_threads=COMPRESS_THREADS, print_only=True)
+    if readers is None:
+        readers = ReaderCache()
+    imposer = Imposer(merger)
+    pdf_files = {}
+    try:
+        with phase('merge'):
+            for merge_info in merge_data:
+                material = merge_info['material']
+                page_ranges = None # type: list
+                padding_size = None # type: tuple
+                sheets = None # type: list
+                if material['filename'] not in pdf_files:
+                    pdf_files[material['filename']] = readers.get(material['filename'])
+                pdf_file = pdf_files[material['filename']]
+                if 'pages' in material:
+                    pages = material['pages']
+                    page_ranges = material.get('ranges') or list(determine_ranges(pages))
                 else:
-                    merger.append(pdf_file)
+                    pages = range(1, pdf_file.getNumPages() + 1)
+
+                if material.get('layout', '1-up') != '1-up':
+                    sheets = imposer.impose([pdf_file.getPage(page - 1) for page in pages], material['layout'])
+                    if len(sheets) % 2 != 0:
+                        padding_size = sheets[-1].mediaBox.getWidth(), sheets[-1].mediaBox.getHeight()
+                elif len(pages) % 2 != 0:
+                    # the material has an odd number of pages
+                    padding_size = get_page_size(pdf_file, pages[-1] - 1)
+    
+                for x in range(int(merge_info['amount'])):  # print material x amount of times
+                    if sheets is not None:
+                        for sheet in sheets:
+                            merger.appendPage(sheet)
+                    elif page_ranges is not None:
+                        for start, stop in page_ranges:
+                            merger.append(pdf_file, pages=(start - 1, stop))
+                    else:
+                        merger.append(pdf_file)
     
-                if add_empty_page:
-                    merger.append('build/emptypage.pdf')
+                    if padding_size is not None:
+                        merger.appendBlankPage(*padding_size)
     
-        merger.write(filename)
+        write_merged_file(merger, filename, 'segment_')
     
     except FileNotFoundError as fnfe:
         print(fnfe.strerror)
 
 
+def merge_segment_files(filename, segments, readers=None, compress_level=None, copy_stream=None):
+    """
+    Assembles a merged PDF file from segment files.
+
+    Every segment is parsed once and its copies share all objects, so the
+    assembly is far cheaper than merging the materials themselves. Like in
+    merge_pdf_files the output is written page by page. The small objects
+    are packed into compressed object streams, which makes the file that is
+    sent to the printer smaller. Segments are written without them, because
+    they are read again for every assembly.
+    :param filename: the path of the merged PDF file
+    :type filename: str
+    :param segments: list of dicts with the path of a segment and its amount
+    :type segments: list
+    :param readers: the reader cache to take the segment files from
+    :type readers: ReaderCache
+    :param compress_level: the zlib level for the streams without a filter or None
+    :type compress_level: int
+    :param copy_stream: a stream that receives a copy of the file while it is written
+    """
+    merger = PdfFileMerger(strict=False, share_inputs=True, streaming=True, dedupe=True, object_streams=True,
+                           compress_level=compress_level, compress_threads=COMPRESS_THREADS, print_only=True)
+    if readers is None:
+        readers = ReaderCache()
+    with phase('merge'):
+        for segment in segments:
+            segment_file = readers.get(segment['path'])
+            for x in range(int(segment['amount'])):
+                merger.append(segment_file)
+
+    if copy_stream is None:
+        write_merged_file(merger, filename, 'output_')
+    else:
+        with open(filename, 'wb') as file:
+            write_merged_file(merger, TeeStream(file, copy_stream), 'output_')
+
+
+def write_merged_file(merger, output, counter=''):
+    """
+    Writes the result of a merger and counts its pages, objects and bytes.
+    :param merger: the merger
+    :type merger: PdfFileMerger
+    :param output: the path of the file or a stream
+    :param counter: the prefix of the counters, so that segments and assembled files are counted separately
+    :type counter: str
+    """
+    with phase('write'):
+        merger.write(output)
+    count(counter + 'pages', merger.output.getNumPages())
+    count(counter + 'objects', len(merger.output._objects))
+    count(counter + 'bytes', output.tell() if hasattr(output, 'tell') else os.path.getsize(output))
+
+
+def get_page_size(pdf_file, page_number):
+    """
+    Returns the size of a page, which is used for the blank padding page after it.
+    :param pdf_file: the PDF file
+    :type pdf_file: PdfFileReader
+    :param page_number: the zero-based number of the page
+    :type page_number: int
+    :return: the width and height of the media box
+    :rtype: tuple
+    """
+    media_box = pdf_file.getPage(page_number).mediaBox
+    return media_box.getWidth(), media_box.getHeight()
+
+
 def determine_ranges(source: list):
     """
     Determines the existing ranges in the list of pages.
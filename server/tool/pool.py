@@ -0,0 +1,65 @@
+"""pool.py: Provides the distribution of print jobs over a pool of printers"""
+
+__author__ = 'Jim Martens'
+
+
+def get_pool_printers(config_data, pool):
+    """
+    Returns the printers of a pool that is defined in data.json.
+
+    The pools are set in the printing section, e.g.
+    ``"printing": {"pools": {"all": ["d001_sw", "d116_sw"]}}``.
+    :param config_data: the decoded data.json
+    :type config_data: dict
+    :param pool: the name of the pool
+    :type pool: str
+    :rtype: list
+    :raises ValueError: if the pool does not exist or has no printers
+    """
+    pools = config_data.get('printing', {}).get('pools', {})
+    printers = pools.get(pool) if isinstance(pool, str) else None
+    if not printers:
+        raise ValueError('Unknown printer pool: ' + str(pool))
+    return list(printers)
+
+
+def split_merge_data(merge_data, page_counts, number_of_shards):
+    """
+    Splits merge data at the boundaries of copies into shards with about the same number of pages.
+
+    The shards keep the order of the copies, so every printer receives a
+    consecutive part of the job. A shard ends at the copy boundary that is
+    closest to its share of the pages. There are fewer shards than requested
+    if the job has fewer copies.
+    :param merge_data: list of dicts with material and amount
+    :type merge_data: list
+    :param page_counts: the number of pages of one copy of every material
+    :type page_counts: list
+    :param number_of_shards: the maximum number of shards
+    :type number_of_shards: int
+    :return: the merge data and the number of pages of every shard
+    :rtype: list
+    """
+    total = sum(int(merge_info['amount']) * pages for merge_info, pages in zip(merge_data, page_counts))
+    shards = []
+    shard = []
+    shard_pages = 0
+    done = 0
+    for merge_info, pages in zip(merge_data, page_counts):
+        for _ in range(int(merge_info['amount'])):
+            target = total * (len(shards) + 1) / number_of_shards
+            # a shard is closed before a copy that would take it further from its target
+            if shard and len(shards) < number_of_shards - 1 and done + pages / 2 > target:
+                shards.append((shard, shard_pages))
+                shard = []
+                shard_pages = 0
+            if shard and shard[-1]['material'] is merge_info['material']:
+                shard[-1]['amount'] += 1
+            else:
+                shard.append({'material': merge_info['material'], 'amount': 1})
+            shard_pages += pages
+            done += pages
+
+    if shard:
+        shards.append((shard, shard_pages))
+    return shards
@@ -1,19 +1,75 @@
 """printing.py; Provides functionality for printing"""
-from subprocess import call
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import DEVNULL, PIPE, Popen, call
+
+from tool.timings import phase
 
 __author__ = 'Jim Martens'
 
+# the number of files that are passed to lpr at the same time
+DEFAULT_PRINT_WORKERS = 4
+
 
 def print_files(printer, files):
     """
     Prints the given files on the given printer.
+
+    The files are passed to lpr one after another, so the print jobs are
+    queued in the given order.
+    :type printer: str
+    :type files: list
+    :return: the exit code of lpr for each file
+    :rtype: list
+    """
+    with phase('lpr'):
+        return [submit_file(printer, file)['exit_code'] for file in files]
+
+
+def submit_files(printer, files, workers=DEFAULT_PRINT_WORKERS):
+    """
+    Passes the given files to lpr concurrently.
+
+    The files must be independent print jobs, because their order in the
+    print queue is not fixed. The time of the submission is the one of the
+    slowest file as long as there are enough workers.
+    :param printer: the printer
     :type printer: str
+    :param files: list of dicts with path, prints and options
     :type files: list
+    :param workers: the number of files that are passed to lpr at the same time
+    :type workers: int
+    :return: dicts with the path, the exit code and the error output of lpr for each file in the same order
+    :rtype: list
+    """
+    if not files:
+        return []
+    with phase('lpr'), ThreadPoolExecutor(max(1, min(workers, len(files)))) as executor:
+        return list(executor.map(lambda file: submit_file(printer, file), files))
+
+
+def submit_file(printer, file):
+    """
+    Passes a file to lpr and waits for it.
+    :param printer: the printer
+    :type printer: str
+    :param file: dict with path, prints and options
+    :type file: dict
+    :return: dict with the path, the exit code and the error output of lpr
+    :rtype: dict
     """
-    for file in files:
-        options = ['-o fitplot', '-o fit-to-page']
-        options += file['options'] if file['options'] else []
-        call(['lpr'] + options + ['-U oe', '-P' + printer, '-# ' + str(file['prints']), file['path']])
+    options = ['-o fitplot', '-o fit-to-page']
+    if int(file['prints']) > 1:
+        # the copies of a multi-page file must not be printed page by page
+        options.append('-o collate=true')
+    options += file['options'] if file['options'] else []
+    process = Popen(['lpr'] + options + ['-U oe', '-P' + printer, '-# ' + str(file['prints']), file['path']],
+                    stdin=DEVNULL, stdout=DEVNULL, stderr=PIPE)
+    error = process.communicate()[1]
+    return {
+        'path': file['path'],
+        'exit_code': process.returncode,
+        'error': error.decode('utf-8', 'replace').strip()
+    }
 
 
 def print_merged_file(printer, merge_file):
@@ -21,5 +77,89 @@ def print_merged_file(printer, merge_file):
     Prints the given merged PDF file on the given printer.
     :param printer: str
     :param merge_file: str
+    :return: the exit code of lpr
+    :rtype: int
+    """
+    with phase('lpr'):
+        return call(get_merged_command(printer, merge_file))
+
+
+def print_merged_files(printers, merge_files):
+    """
+    Prints merged PDF files on several printers at the same time.
+    :param printers: the printers
+    :type printers: list
+    :param merge_files: the file for every printer
+    :type merge_files: list
+    :return: the exit code of lpr for each file
+    :rtype: list
+    """
+    with phase('lpr'):
+        processes = [Popen(get_merged_command(printer, merge_file))
+                     for printer, merge_file in zip(printers, merge_files)]
+        return [process.wait() for process in processes]
+
+
+def get_merged_command(printer, merge_file=None):
+    """
+    Returns the lpr command for a merged PDF file.
+    :param printer: the printer
+    :type printer: str
+    :param merge_file: the file or None to read it from the standard input
+    :type merge_file: str
+    :rtype: list
     """
-    call(['lpr', '-o fitplot', '-o fit-to-page', '-U oe', '-P' + printer, '-#1', merge_file])
+    command = ['lpr', '-o fitplot', '-o fit-to-page', '-U oe', '-P' + printer, '-#1']
+    if merge_file is not None:
+        command.append(merge_file)
+    return command
+
+
+class PrintPipe:
+    """
+    Passes a merged PDF file to lpr while it is being written.
+
+    lpr reads the file from its standard input, so the spooling starts
+    before the merge has finished. A pipe that could not be filled
+    completely must be aborted, so no truncated file is printed.
+    """
+    def __init__(self, printer):
+        """
+        Starts lpr for the given printer.
+        :param printer: the printer
+        :type printer: str
+        """
+        self._process = Popen(get_merged_command(printer), stdin=PIPE)
+        self._broken = False
+
+    def write(self, data):
+        """
+        Passes data to lpr. If lpr has exited, the data is dropped.
+        :type data: bytes
+        """
+        if self._broken:
+            return
+        try:
+            self._process.stdin.write(data)
+        except BrokenPipeError:
+            self._broken = True
+
+    def close(self):
+        """
+        Finishes the input of lpr and waits for it.
+        :return: the exit code of lpr
+        :rtype: int
+        """
+        with phase('lpr'):
+            try:
+                self._process.stdin.close()
+            except BrokenPipeError:
+                pass
+            return self._process.wait()
+
+    def abort(self):
+        """
+        Stops lpr before it submits the job.
+        """
+        self._process.kill()
+        self._process.wait()
@@ -0,0 +1,128 @@
+"""profiling.py: Provides the profiling of slow oeprint commands"""
+import cProfile
+import os
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+__author__ = 'Jim Martens'
+
+PROFILE_DIRECTORY = os.path.join('build', 'profiles')
+
+# the number of allocation sites in the summary
+TOP_ALLOCATIONS = 25
+
+# the number of frames that are stored for every allocation
+ALLOCATION_FRAMES = 10
+
+# True while a profile is recorded, profiles cannot be nested
+_active = False
+
+
+@contextmanager
+def profiled(name, path=None, threshold=None, directory=PROFILE_DIRECTORY):
+    """
+    Profiles the with block with cProfile.
+
+    If a path is given, the whole block is profiled and the allocations are
+    traced with tracemalloc as well. Otherwise the block is only profiled
+    if there is a threshold: a timer enables the profiler once the block
+    has run for the threshold, so blocks that finish earlier do not pay for
+    profiling and the profile of a slow block covers the time after the
+    threshold. The allocations are not traced then. The timer needs the
+    main thread, so nothing is profiled with a threshold in other threads.
+    Nothing is profiled if a profile is recorded already.
+    :param name: the name of the profiled command or job, which is part of the default path
+    :type name: str
+    :param path: the path for the profile without extension or an empty string for the default path
+    :type path: str
+    :param threshold: the duration in seconds after which the block is profiled or None
+    :type threshold: float
+    :param directory: the directory for the profiles with the default path
+    :type directory: str
+    """
+    global _active
+    timed = threshold is not None and threading.current_thread() is threading.main_thread()
+    if _active or (path is None and not timed):
+        yield
+        return
+
+    _active = True
+    profile = cProfile.Profile()
+    enabled = []
+
+    def enable(signum=None, frame=None):
+        profile.enable()
+        enabled.append(True)
+
+    previous_handler = None
+    start = time.perf_counter()
+    if path is not None:
+        tracemalloc.start(ALLOCATION_FRAMES)
+        enable()
+    else:
+        previous_handler = signal.signal(signal.SIGALRM, enable)
+        signal.setitimer(signal.ITIMER_REAL, threshold)
+    try:
+        yield
+    finally:
+        if path is None:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous_handler)
+        profile.disable()
+        duration = time.perf_counter() - start
+        snapshot = None
+        if path is not None:
+            snapshot = (tracemalloc.take_snapshot(), tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        _active = False
+        if enabled:
+            if not path:
+                path = os.path.join(directory, '{}-{}'.format(time.strftime('%Y%m%d%H%M%S'), name))
+            save_profile(path, name, profile, duration, snapshot)
+
+
+def save_profile(path, name, profile, duration, snapshot=None):
+    """
+    Writes a profile as .pstats file and the allocation summary as .alloc.txt file.
+    :param path: the path for the profile without extension
+    :type path: str
+    :param name: the name of the profiled command or job
+    :type name: str
+    :param profile: the profile
+    :type profile: cProfile.Profile
+    :param duration: the duration of the profiled block in seconds
+    :type duration: float
+    :param snapshot: the tracemalloc snapshot and the peak of the traced memory or None
+    :type snapshot: tuple
+    """
+    if path.endswith('.pstats'):
+        path = path[:-len('.pstats')]
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    profile.dump_stats(path + '.pstats')
+    written = [path + '.pstats']
+    if snapshot is not None:
+        allocations, peak = snapshot
+        with open(path + '.alloc.txt', 'w', encoding='utf-8') as file:
+            file.write('{}: {:.3f} s, peak of traced memory {} KB\n'.format(name, duration, peak // 1024))
+            file.write('top {} allocation sites by size:\n'.format(TOP_ALLOCATIONS))
+            for statistic in allocations.statistics('lineno')[:TOP_ALLOCATIONS]:
+                file.write(str(statistic) + '\n')
+        written.append(path + '.alloc.txt')
+    sys.stderr.write('Profile of {} ({:.3f} s) written to {}\n'.format(name, duration, ', '.join(written)))
+
+
+def get_profile_threshold(config_data):
+    """
+    Returns the duration after which a job is profiled from the optional profiling section of data.json.
+    :param config_data: the decoded data.json
+    :type config_data: dict
+    :return: the threshold in seconds or None if slow jobs are not profiled
+    :rtype: float
+    """
+    threshold = config_data.get('profiling', {}).get('threshold')
+    return float(threshold) if threshold is not None else None
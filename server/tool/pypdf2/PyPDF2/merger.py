@@ -29,7 +29,7 @@
 
 from .generic import *
 from .utils import string_type
-from .pdf import PdfFileReader, PdfFileWriter
+from .pdf import PdfFileReader, PdfFileWriter, PageObject
 from .pagerange import PageRange
 from sys import version_info
 if version_info < ( 3, 0 ):
@@ -51,6 +51,18 @@ class _MergedPage(object):
         self.out_pagedata = None
         self.id = id
         
+def _isPrinted(annot):
+    """
+    Checks whether an annotation appears on paper. Links and popups are
+    never printed, other annotations only with the print flag and without
+    the hidden flag.
+    """
+    if annot.get("/Subtype") in ("/Link", "/Popup"):
+        return False
+    flags = annot.get("/F", 0)
+    return bool(flags & 4) and not flags & 2
+
+
 class PdfFileMerger(object):
     """
     Initializes a PdfFileMerger object. PdfFileMerger merges multiple PDFs
@@ -63,16 +75,47 @@ class PdfFileMerger(object):
     :param bool strict: Determines whether user should be warned of all
             problems and also causes some correctable problems to be fatal.
             Defaults to ``True``.
+    :param bool share_inputs: Copy-aware mode. Every input (reader or path)
+            is parsed only once, no matter how often it is merged, and
+            repeated pages share the content streams and resources of the
+            first copy in the output. Bookmarks and named destinations are
+            only imported for the first use of an input. Defaults to ``False``.
+    :param bool streaming: Writes the output with a streaming
+            :class:`PdfFileWriter<PyPDF2.pdf.PdfFileWriter>`, which keeps the
+            memory bounded by the largest page. Defaults to ``False``.
+    :param bool dedupe: Collapses identical objects of the inputs, like
+            fonts embedded by several inputs, in the output. Defaults to
+            ``False``.
+    :param bool object_streams: Writes a PDF 1.5 output with compressed
+            object streams and a cross-reference stream. Defaults to
+            ``False``.
+    :param int compress_level: Compresses the streams of the output that
+            have no filter at this zlib level. Defaults to ``None``.
+    :param int compress_threads: The number of threads that compress the
+            streams. Defaults to ``1``.
+    :param bool print_only: Merges only what is printed. Outlines and named
+            destinations are neither read nor written, bookmarks are
+            ignored, and annotations that are not printed (links, popups and
+            annotations without the print flag) are removed from the pages.
+            Defaults to ``False``.
     """
     
-    def __init__(self, strict=True):
+    def __init__(self, strict=True, share_inputs=False, streaming=False, dedupe=False, object_streams=False,
+                 compress_level=None, compress_threads=1, print_only=False):
         self.inputs = []
         self.pages = []
-        self.output = PdfFileWriter()
+        self.output = PdfFileWriter(streaming=streaming, dedupe=dedupe, object_streams=object_streams,
+                                    compress_level=compress_level, compress_threads=compress_threads)
         self.bookmarks = []
         self.named_dests = []
         self.id_count = 0
         self.strict = strict
+        self.share_inputs = share_inputs
+        self._shared_readers = {}
+        self._merged_pages = set()
+        self._blank_contents = None
+        self.print_only = print_only
+        self._printed_annots = {}
         
     def merge(self, position, fileobj, bookmark=None, pages=None, import_bookmarks=True):
         """
@@ -100,6 +143,10 @@ class PdfFileMerger(object):
         # This parameter is passed to self.inputs.append and means
         # that the stream used was created in this method.
         my_file = False
+
+        if self.share_inputs:
+            self._merge_shared(position, fileobj, bookmark, pages, import_bookmarks)
+            return
         
         # If the fileobj parameter is a string, assume it is a path
         # and create a file object at that location. If it is a file,
@@ -136,26 +183,29 @@ class PdfFileMerger(object):
             raise TypeError('"pages" must be a tuple of (start, stop[, step])')
         
         srcpages = []
-        if bookmark:
+        if bookmark and not self.print_only:
             bookmark = Bookmark(TextStringObject(bookmark), NumberObject(self.id_count), NameObject('/Fit'))
         
         outline = []
-        if import_bookmarks:
+        if import_bookmarks and not self.print_only:
             outline = pdfr.getOutlines()
             outline = self._trim_outline(pdfr, outline, pages)
         
-        if bookmark:
+        if bookmark and not self.print_only:
             self.bookmarks += [bookmark, outline]
         else:
             self.bookmarks += outline
         
-        dests = pdfr.namedDestinations
-        dests = self._trim_dests(pdfr, dests, pages)
-        self.named_dests += dests
+        if not self.print_only:
+            dests = pdfr.namedDestinations
+            dests = self._trim_dests(pdfr, dests, pages)
+            self.named_dests += dests
         
         # Gather all the pages that are going to be merged
         for i in range(*pages):
             pg = pdfr.getPage(i)
+            if self.print_only:
+                pg = self._printed_page(pg)
             
             id = self.id_count
             self.id_count += 1
@@ -164,8 +214,9 @@ class PdfFileMerger(object):
             
             srcpages.append(mp)
 
-        self._associate_dests_to_pages(srcpages)
-        self._associate_bookmarks_to_pages(srcpages)
+        if not self.print_only:
+            self._associate_dests_to_pages(srcpages)
+            self._associate_bookmarks_to_pages(srcpages)
             
         
         # Slice to insert the pages at the specified position
@@ -173,6 +224,83 @@ class PdfFileMerger(object):
         
         # Keep track of our input files so we can close them later
         self.inputs.append((fileobj, pdfr, my_file))
+
+    def _merge_shared(self, position, fileobj, bookmark, pages, import_bookmarks):
+        """
+        Copy-aware variant of :meth:`merge()<merge>`. Readers are reused
+        instead of being re-parsed from a copy of their stream, so every
+        object of an input ends up only once in the output.
+        """
+        my_file = False
+        if isinstance(fileobj, PdfFileReader):
+            pdfr = fileobj
+        elif type(fileobj) == string_type and fileobj in self._shared_readers:
+            pdfr = self._shared_readers[fileobj]
+        else:
+            key = fileobj
+            if type(fileobj) == string_type:
+                fileobj = file(fileobj, 'rb')
+                my_file = True
+            pdfr = PdfFileReader(fileobj, strict=self.strict)
+            if type(key) == string_type:
+                self._shared_readers[key] = pdfr
+
+        first_use = all(pdfr is not r for _, r, _ in self.inputs)
+        if first_use:
+            self.inputs.append((fileobj, pdfr, my_file))
+
+        if pages == None:
+            pages = (0, pdfr.getNumPages())
+        elif isinstance(pages, PageRange):
+            pages = pages.indices(pdfr.getNumPages())
+        elif not isinstance(pages, tuple):
+            raise TypeError('"pages" must be a tuple of (start, stop[, step])')
+
+        # navigation structures of a shared input are imported once, the
+        # copies merged afterwards are plain pages
+        navigation = first_use and not self.print_only
+        if bookmark and not self.print_only:
+            bookmark = Bookmark(TextStringObject(bookmark), NumberObject(self.id_count), NameObject('/Fit'))
+
+        outline = []
+        if import_bookmarks and navigation:
+            outline = pdfr.getOutlines()
+            outline = self._trim_outline(pdfr, outline, pages)
+
+        if bookmark and not self.print_only:
+            self.bookmarks += [bookmark, outline]
+        else:
+            self.bookmarks += outline
+
+        if navigation:
+            dests = pdfr.namedDestinations
+            dests = self._trim_dests(pdfr, dests, pages)
+            self.named_dests += dests
+
+        srcpages = []
+        for i in range(*pages):
+            pg = pdfr.getPage(i)
+            if self.print_only:
+                pg = self._printed_page(pg)
+            if id(pg) in self._merged_pages:
+                # a page may only appear once in the page tree: the copy gets
+                # its own page dictionary, but all values (content streams,
+                # resources, annotations) still point to the same objects
+                copy = PageObject(pdfr)
+                copy.update(pg)
+                pg = copy
+            else:
+                self._merged_pages.add(id(pg))
+
+            mp = _MergedPage(pg, pdfr, self.id_count)
+            self.id_count += 1
+            srcpages.append(mp)
+
+        if navigation:
+            self._associate_dests_to_pages(srcpages)
+            self._associate_bookmarks_to_pages(srcpages)
+
+        self.pages[position:position] = srcpages
         
         
     def append(self, fileobj, bookmark=None, pages=None, import_bookmarks=True):
@@ -196,8 +324,56 @@ class PdfFileMerger(object):
         """
         
         self.merge(len(self.pages), fileobj, bookmark, pages, import_bookmarks)
+
+    def appendPage(self, page):
+        """
+        Appends a single page, for example one that was created with
+        :meth:`createBlankPage()<PyPDF2.pdf.PageObject.createBlankPage>`.
+        A page that is appended several times is copied, but all copies
+        share the values of the page.
+
+        :param PageObject page: The page to append.
+        """
+        if id(page) in self._merged_pages:
+            copy = PageObject(page.pdf)
+            copy.update(page)
+            page = copy
+        else:
+            self._merged_pages.add(id(page))
+
+        self.pages.append(_MergedPage(page, page.pdf, self.id_count))
+        self.id_count += 1
+
+    def appendBlankPage(self, width, height):
+        """
+        Appends a blank page of the given size without reading any file.
+        All blank pages of the output share a single empty content stream,
+        only their small page dictionaries are written separately.
+
+        :param width: The width of the page expressed in default user
+            space units.
+        :param height: The height of the page expressed in default user
+            space units.
+        """
+        if self._blank_contents is None:
+            contents = DecodedStreamObject()
+            contents.setData(b_(""))
+            self._blank_contents = self.addObject(contents)
+
+        page = PageObject.createBlankPage(None, width, height)
+        page[NameObject('/Contents')] = self._blank_contents
+        self.appendPage(page)
+
+    def addObject(self, obj):
+        """
+        Adds an object to the output, so that several pages can refer to it.
+
+        :param obj: The object to add.
+        :return: A reference to the object in the output.
+        :rtype: :class:`IndirectObject<PyPDF2.generic.IndirectObject>`
+        """
+        return self.output._addObject(obj)
         
-    
     def write(self, fileobj):
         """
         Writes all data that has been merged to the given output file.
@@ -215,13 +391,14 @@ class PdfFileMerger(object):
         # The commented out line below was replaced with the two lines below it to allow PdfFileMerger to work with PyPdf 1.13
         for page in self.pages:
             self.output.addPage(page.pagedata)
-            page.out_pagedata = self.output.getReference(self.output._pages.getObject()["/Kids"][-1].getObject())
+            page.out_pagedata = self.output._pages.getObject()["/Kids"][-1]
             #idnum = self.output._objects.index(self.output._pages.getObject()["/Kids"][-1].getObject()) + 1
             #page.out_pagedata = IndirectObject(idnum, 0, self.output)
 
         # Once all pages are added, create bookmarks to point at those pages
-        self._write_dests()
-        self._write_bookmarks()
+        if not self.print_only:
+            self._write_dests()
+            self._write_bookmarks()
         
         # Write the output to the file   
         self.output.write(fileobj)
@@ -243,6 +420,43 @@ class PdfFileMerger(object):
         
         self.inputs = []
         self.output = None
+        self._shared_readers = {}
+        self._merged_pages = set()
+        self._blank_contents = None
+        self._printed_annots = {}
+
+    def _printed_page(self, page):
+        """
+        Returns the page without the annotations that are not printed.
+        Pages without such annotations are returned as they are, otherwise
+        a copy is returned, so the input is not modified. The annotations
+        of every page are only examined once, all copies of the page share
+        the list of the remaining annotations.
+        """
+        if "/Annots" not in page:
+            return page
+        if id(page) not in self._printed_annots:
+            annots = page["/Annots"].getObject()
+            printed = ArrayObject([annot for annot in annots if _isPrinted(annot.getObject())])
+            # the page is kept, so its id cannot be reused by another page
+            self._printed_annots[id(page)] = (page, printed, len(printed) == len(annots))
+        printed, unchanged = self._printed_annots[id(page)][1:]
+        if unchanged:
+            return page
+
+        if id(page) in self._merged_pages:
+            copy = PageObject(page.pdf)
+        else:
+            # the first copy stands in for the page, so that the remaining
+            # annotations still refer to it
+            self._merged_pages.add(id(page))
+            copy = PageObject(page.pdf, page.indirectRef)
+        copy.update(page)
+        if printed:
+            copy[NameObject("/Annots")] = printed
+        else:
+            del copy["/Annots"]
+        return copy
 
     def addMetadata(self, infos):
         """
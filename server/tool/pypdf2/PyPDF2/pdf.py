@@ -42,9 +42,13 @@ __author_email__ = "biziqe@mathieu.fenniak.net"
 __maintainer__ = "Phaseit, Inc."
 __maintainer_email = "PyPDF2@phaseit.net"
 
+import copy
+import hashlib
 import math
 import struct
 import sys
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from sys import version_info
 if version_info < ( 3, 0 ):
     from cStringIO import StringIO
@@ -59,6 +63,7 @@ else:
 from .generic import *
 from .utils import readNonWhitespace, readUntilWhitespace, ConvertFunctionsToVirtualList
 from .utils import Str, b_, u_, ord_, str_, string_type, formatWarning
+from .filters import FlateDecode
 
 if version_info < ( 2, 4 ):
    from sets import ImmutableSet as frozenset
@@ -73,10 +78,40 @@ class PdfFileWriter(object):
     """
     This class supports writing PDF files out, given pages produced by another
     class (typically :class:`PdfFileReader<PdfFileReader>`).
+
+    :param bool streaming: Write the objects of each page as soon as they
+        have been copied and release them afterwards, so the memory needed by
+        :meth:`write()<write>` is bounded by the largest page instead of the
+        whole document. After writing, the pages of the writer can no longer
+        be accessed. Defaults to ``False``.
+    :param bool dedupe: Whether objects copied from other documents are
+        collapsed if they are identical, for example the same font embedded
+        by several input files. Streams are compared by their raw data,
+        dictionaries and arrays by their normalized form. Defaults to
+        ``False``.
+    :param bool object_streams: Whether the output is a PDF 1.5 file in
+        which all objects except streams are packed into compressed object
+        streams and the cross-reference table is a compressed stream as
+        well. Defaults to ``False``.
+    :param int compress_level: If set, all streams without a filter are
+        compressed with FlateDecode at this zlib level (1-9) when they are
+        written. Streams that are already encoded are left alone. Defaults
+        to ``None``.
+    :param int compress_threads: The number of threads that compress the
+        streams. The output does not depend on it. Defaults to ``1``.
     """
-    def __init__(self):
+    # the number of objects that are packed into one object stream
+    OBJECTS_PER_STREAM = 200
+
+    def __init__(self, streaming=False, dedupe=False, object_streams=False, compress_level=None,
+                 compress_threads=1):
         self._header = b_("%PDF-1.3")
         self._objects = []  # array of indirect objects
+        self.streaming = streaming
+        self.dedupe = dedupe
+        self.object_streams = object_streams
+        self.compress_level = compress_level
+        self.compress_threads = compress_threads
 
         # The root of our page tree node.
         pages = DictionaryObject()
@@ -305,40 +340,53 @@ class PdfFileWriter(object):
                     externalReferenceMap[data.pdf][data.generation] = {}
                 externalReferenceMap[data.pdf][data.generation][data.idnum] = IndirectObject(objIndex + 1, 0, self)
 
-        self.stack = []
+        header = self._header
+        if self.object_streams and header < b_("%PDF-1.5"):
+            header = b_("%PDF-1.5")
+        stream.write(header + b_("\n"))
+        object_positions = {}
+        self._compressedObjects = {}
+        self._objectStreamBuffer = []
+        self._compressor = None
+        if self.compress_level is not None and self.compress_threads > 1:
+            # zlib releases the GIL, so the streams are compressed in parallel
+            self._compressor = ThreadPoolExecutor(self.compress_threads)
+        self.stack = set()
+        self._sweptIds = []
+        self._dedupeRefs = {}
+        self._cyclicIds = set()
+        self._freeIds = set()
         if debug: print(("ERM:", externalReferenceMap, "root:", self._root))
-        self._sweepIndirectReferences(externalReferenceMap, self._root)
-        del self.stack
-
-        # Begin writing:
-        object_positions = []
-        stream.write(self._header + b_("\n"))
-        for i in range(len(self._objects)):
-            idnum = (i + 1)
-            obj = self._objects[i]
-            object_positions.append(stream.tell())
-            stream.write(b_(str(idnum) + " 0 obj\n"))
-            key = None
-            if hasattr(self, "_encrypt") and idnum != self._encrypt.idnum:
-                pack1 = struct.pack("<i", i + 1)[:3]
-                pack2 = struct.pack("<i", 0)[:2]
-                key = self._encrypt_key + pack1 + pack2
-                assert len(key) == (len(self._encrypt_key) + 5)
-                md5_hash = md5(key).digest()
-                key = md5_hash[:min(16, len(self._encrypt_key) + 5)]
-            obj.writeToStream(stream, key)
-            stream.write(b_("\nendobj\n"))
+        if self.streaming:
+            # the objects that may still change are written last, the page
+            # tree is marked as swept so that sweeping a page does not reach
+            # the other pages through /Parent
+            pending = set([self._pages.idnum, self._info.idnum, self._root.idnum])
+            if hasattr(self, "_encrypt"):
+                pending.add(self._encrypt.idnum)
+            self.stack.add(self._pages.idnum)
+            for page in self.getObject(self._pages)["/Kids"]:
+                self._sweepIndirectReferences(externalReferenceMap, page)
+                self._writeSweptObjects(stream, object_positions, pending)
+            self._sweepIndirectReferences(externalReferenceMap, self._root)
+            self._writeSweptObjects(stream, object_positions, set())
+        else:
+            self._sweepIndirectReferences(externalReferenceMap, self._root)
+        idnums = [idnum for idnum in range(1, len(self._objects) + 1)
+                  if idnum not in object_positions and idnum not in self._freeIds]
+        self._compressStreams(idnums)
+        for idnum in idnums:
+            self._writeObject(stream, object_positions, idnum)
+        self._writeObjectStream(stream, object_positions)
+        if self._compressor is not None:
+            self._compressor.shutdown()
+        # the numbers of collapsed duplicates form the list of free objects
+        freeIds = sorted(self._freeIds) + [0]
+        nextFreeIds = dict(zip(freeIds, freeIds[1:]))
+        compressedObjects = self._compressedObjects
+        del self.stack, self._sweptIds, self._dedupeRefs, self._cyclicIds, self._freeIds
+        del self._compressedObjects, self._objectStreamBuffer, self._compressor
 
-        # xref table
-        xref_location = stream.tell()
-        stream.write(b_("xref\n"))
-        stream.write(b_("0 %s\n" % (len(self._objects) + 1)))
-        stream.write(b_("%010d %05d f \n" % (0, 65535)))
-        for offset in object_positions:
-            stream.write(b_("%010d %05d n \n" % (offset, 0)))
-
-        # trailer
-        stream.write(b_("trailer\n"))
         trailer = DictionaryObject()
         trailer.update({
                 NameObject("/Size"): NumberObject(len(self._objects) + 1),
@@ -349,11 +397,190 @@ class PdfFileWriter(object):
             trailer[NameObject("/ID")] = self._ID
         if hasattr(self, "_encrypt"):
             trailer[NameObject("/Encrypt")] = self._encrypt
-        trailer.writeToStream(stream, None)
+
+        if self.object_streams:
+            xref_location = self._writeXRefStream(stream, object_positions, freeIds[0], nextFreeIds,
+                                                  compressedObjects, trailer)
+        else:
+            # xref table
+            xref_location = stream.tell()
+            stream.write(b_("xref\n"))
+            stream.write(b_("0 %s\n" % (len(self._objects) + 1)))
+            stream.write(b_("%010d %05d f \n" % (freeIds[0], 65535)))
+            for idnum in range(1, len(self._objects) + 1):
+                if idnum in nextFreeIds:
+                    stream.write(b_("%010d %05d f \n" % (nextFreeIds[idnum], 1)))
+                else:
+                    stream.write(b_("%010d %05d n \n" % (object_positions[idnum], 0)))
+
+            # trailer
+            stream.write(b_("trailer\n"))
+            trailer.writeToStream(stream, None)
 
         # eof
         stream.write(b_("\nstartxref\n%s\n%%%%EOF\n" % (xref_location)))
 
+    def _writeSweptObjects(self, stream, object_positions, pending):
+        # writes the objects swept since the last call except the pending ones
+        self._compressStreams([idnum for idnum in self._sweptIds
+                               if idnum not in pending and idnum not in object_positions])
+        remaining = []
+        for idnum in self._sweptIds:
+            if idnum in pending:
+                remaining.append(idnum)
+            elif idnum not in object_positions:
+                self._writeObject(stream, object_positions, idnum)
+                if self.streaming:
+                    self._objects[idnum - 1] = None
+        self._sweptIds = remaining
+
+    def _compressStreams(self, idnums):
+        # flate encodes the streams without a filter among the given objects
+        # before they are written; the results are taken in order, so the
+        # output is the same for any number of threads
+        if self.compress_level is None:
+            return
+        idnums = [idnum for idnum in idnums if isinstance(self._objects[idnum - 1], StreamObject)
+                  and "/Filter" not in self._objects[idnum - 1]]
+        level = self.compress_level
+        data = [self._objects[idnum - 1]._data for idnum in idnums]
+        if self._compressor is not None and len(idnums) > 1:
+            compressed = list(self._compressor.map(lambda d: zlib.compress(d, level), data))
+        else:
+            compressed = [zlib.compress(d, level) for d in data]
+
+        for idnum, encodedData in zip(idnums, compressed):
+            obj = self._objects[idnum - 1]
+            if len(encodedData) >= len(obj._data):
+                continue
+            encoded = EncodedStreamObject()
+            encoded.update(obj)
+            encoded[NameObject("/Filter")] = NameObject("/FlateDecode")
+            encoded._data = encodedData
+            self._objects[idnum - 1] = encoded
+
+    def _writeObject(self, stream, object_positions, idnum):
+        obj = self._objects[idnum - 1]
+        if self.object_streams and not isinstance(obj, StreamObject) and \
+                not (hasattr(self, "_encrypt") and idnum == self._encrypt.idnum):
+            # objects in object streams are only encrypted with their stream
+            data = BytesIO()
+            obj.writeToStream(data, None)
+            self._objectStreamBuffer.append((idnum, data.getvalue()))
+            object_positions[idnum] = None
+            if len(self._objectStreamBuffer) >= self.OBJECTS_PER_STREAM:
+                self._writeObjectStream(stream, object_positions)
+            return
+        object_positions[idnum] = stream.tell()
+        stream.write(b_(str(idnum) + " 0 obj\n"))
+        key = None
+        if hasattr(self, "_encrypt") and idnum != self._encrypt.idnum:
+            pack1 = struct.pack("<i", idnum)[:3]
+            pack2 = struct.pack("<i", 0)[:2]
+            key = self._encrypt_key + pack1 + pack2
+            assert len(key) == (len(self._encrypt_key) + 5)
+            md5_hash = md5(key).digest()
+            key = md5_hash[:min(16, len(self._encrypt_key) + 5)]
+        obj.writeToStream(stream, key)
+        stream.write(b_("\nendobj\n"))
+
+    def _getDedupeKey(self, obj):
+        # hashes the normalized form of a copied object, whose references
+        # already point to this writer; pages are never collapsed
+        if isinstance(obj, DictionaryObject) and obj.get("/Type") in ("/Page", "/Pages"):
+            return None
+        normalized = BytesIO()
+        self._writeNormalized(normalized, obj)
+        hash = hashlib.sha256(normalized.getvalue())
+        if isinstance(obj, StreamObject):
+            hash.update(obj._data)
+        return hash.digest()
+
+    def _writeNormalized(self, stream, obj):
+        if isinstance(obj, DictionaryObject):
+            stream.write(b_("<<"))
+            for key in sorted(obj.keys()):
+                if key == "/Length" and isinstance(obj, StreamObject):
+                    continue
+                stream.write(b_(key + " "))
+                self._writeNormalized(stream, obj.raw_get(key))
+                stream.write(b_(" "))
+            stream.write(b_(">>"))
+        elif isinstance(obj, ArrayObject):
+            stream.write(b_("["))
+            for value in obj:
+                self._writeNormalized(stream, value)
+                stream.write(b_(" "))
+            stream.write(b_("]"))
+        else:
+            obj.writeToStream(stream, None)
+
+    def _writeObjectStream(self, stream, object_positions):
+        # packs the buffered objects into a compressed object stream
+        if not self._objectStreamBuffer:
+            return
+        offsets = []
+        objects = BytesIO()
+        for idnum, data in self._objectStreamBuffer:
+            offsets.append("%d %d" % (idnum, objects.tell()))
+            objects.write(data)
+            objects.write(b_("\n"))
+        header = b_(" ".join(offsets) + "\n")
+
+        objectStream = EncodedStreamObject()
+        objectStream.update({
+                NameObject("/Type"): NameObject("/ObjStm"),
+                NameObject("/N"): NumberObject(len(self._objectStreamBuffer)),
+                NameObject("/First"): NumberObject(len(header)),
+                NameObject("/Filter"): NameObject("/FlateDecode"),
+                })
+        objectStream._data = FlateDecode.encode(header + objects.getvalue())
+        reference = self._addObject(objectStream)
+        for index, (idnum, data) in enumerate(self._objectStreamBuffer):
+            self._compressedObjects[idnum] = (reference.idnum, index)
+        self._objectStreamBuffer = []
+        self._writeObject(stream, object_positions, reference.idnum)
+        if self.streaming:
+            self._objects[reference.idnum - 1] = None
+
+    def _writeXRefStream(self, stream, object_positions, firstFreeId, nextFreeIds, compressedObjects, trailer):
+        # writes the cross-reference stream, which also takes the place of
+        # the trailer, and returns its position
+        xref_location = stream.tell()
+        idnum = len(self._objects) + 1
+        object_positions[idnum] = xref_location
+        offsetSize = max(1, (xref_location.bit_length() + 7) // 8)
+        # entry 0 is the head of the list of free objects
+        entries = [(0, firstFreeId, 65535)]
+        for i in range(1, idnum + 1):
+            if i in nextFreeIds:
+                entries.append((0, nextFreeIds[i], 1))
+            elif i in compressedObjects:
+                entries.append((2,) + compressedObjects[i])
+            else:
+                entries.append((1, object_positions[i], 0))
+        data = b_("").join(struct.pack(">B", kind) + struct.pack(">Q", field)[-offsetSize:] +
+                           struct.pack(">H", index) for kind, field, index in entries)
+
+        xref = EncodedStreamObject()
+        xref.update(trailer)
+        xref.update({
+                NameObject("/Type"): NameObject("/XRef"),
+                NameObject("/Size"): NumberObject(idnum + 1),
+                NameObject("/W"): ArrayObject([NumberObject(1), NumberObject(offsetSize), NumberObject(2)]),
+                NameObject("/Filter"): NameObject("/FlateDecode"),
+                })
+        xref._data = FlateDecode.encode(data)
+        # cross-reference streams are never encrypted
+        stream.write(b_(str(idnum) + " 0 obj\n"))
+        xref.writeToStream(stream, None)
+        stream.write(b_("\nendobj"))
+        return xref_location
+
+    def _markSwept(self, idnum):
+        self.stack.add(idnum)
+        self._sweptIds.append(idnum)
+
     def addMetadata(self, infos):
         """
         Add custom metadata to the output.
@@ -377,6 +604,7 @@ class PdfFileWriter(object):
                     # a dictionary value is a stream.  streams must be indirect
                     # objects, so we need to change this value.
                     value = self._addObject(value)
+                    self._markSwept(value.idnum)
                 data[key] = value
             return data
         elif isinstance(data, ArrayObject):
@@ -386,6 +614,7 @@ class PdfFileWriter(object):
                     # an array value is a stream.  streams must be indirect
                     # objects, so we need to change this value
                     value = self._addObject(value)
+                    self._markSwept(value.idnum)
                 data[i] = value
             return data
         elif isinstance(data, IndirectObject):
@@ -394,7 +623,7 @@ class PdfFileWriter(object):
                 if data.idnum in self.stack:
                     return data
                 else:
-                    self.stack.append(data.idnum)
+                    self._markSwept(data.idnum)
                     realdata = self.getObject(data)
                     self._sweepIndirectReferences(externMap, realdata)
                     return data
@@ -411,8 +640,28 @@ class PdfFileWriter(object):
                         externMap[data.pdf][data.generation] = {}
                     externMap[data.pdf][data.generation][data.idnum] = newobj_ido
                     newobj = self._sweepIndirectReferences(externMap, newobj)
+                    if self.streaming and isinstance(data.pdf, PdfFileReader):
+                        # the copy is written soon, the reader does not
+                        # need to keep the parsed object any longer
+                        data.pdf.resolvedObjects.pop((data.generation, data.idnum), None)
+                    if self.dedupe and idnum not in self._cyclicIds:
+                        # objects that refer back to themselves keep their
+                        # number, so they are never collapsed
+                        key = self._getDedupeKey(newobj)
+                        if key in self._dedupeRefs:
+                            newobj_ido = self._dedupeRefs[key]
+                            externMap[data.pdf][data.generation][data.idnum] = newobj_ido
+                            self._freeIds.add(idnum)
+                            return newobj_ido
+                        if key is not None:
+                            self._dedupeRefs[key] = newobj_ido
                     self._objects[idnum-1] = newobj
+                    self._markSwept(idnum)
                     return newobj_ido
+                if self.dedupe and self._objects[newobj.idnum - 1] is None:
+                    # a reference to an object that is still being copied
+                    # (or was already written while streaming)
+                    self._cyclicIds.add(newobj.idnum)
                 return newobj
         else:
             return data
@@ -910,6 +1159,38 @@ class PdfFileReader(object):
 
         self._override_encryption = False
 
+    def createView(self):
+        """
+        Returns a new reader for the same document without parsing it again.
+        The view shares the stream and the cross-reference tables with this
+        reader, but has its own object cache. Objects read through the view
+        can therefore be modified (for example by merging them into a
+        :class:`PdfFileWriter<PdfFileWriter>`) without affecting this reader
+        or other views.
+
+        :return: a view of this reader
+        :rtype: :class:`PdfFileReader<PdfFileReader>`
+        """
+        view = copy.copy(self)
+        view.resolvedObjects = {}
+        view.flattenedPages = None
+        view.trailer = view._bindObject(self.trailer)
+        return view
+
+    def _bindObject(self, obj):
+        # copies the direct structure of obj with all indirect references
+        # pointing to this reader
+        if isinstance(obj, IndirectObject):
+            return IndirectObject(obj.idnum, obj.generation, self)
+        elif isinstance(obj, DictionaryObject):
+            retval = DictionaryObject()
+            for key, value in list(obj.items()):
+                retval[key] = self._bindObject(value)
+            return retval
+        elif isinstance(obj, ArrayObject):
+            return ArrayObject([self._bindObject(value) for value in obj])
+        return obj
+
     def getDocumentInfo(self):
         """
         Retrieves the PDF file's document information dictionary, if it exists.
@@ -962,10 +1243,12 @@ class PdfFileReader(object):
             this action.
         """
 
-        # Flattened pages will not work on an Encrypted PDF;
-        # the PDF file's page count is used in this case. Otherwise,
-        # the original method (flattened page count) is used.
-        if self.isEncrypted:
+        # Flattened pages will not work on an Encrypted PDF that has not
+        # been decrypted; the PDF file's page count is used in this case.
+        # Otherwise, the original method (flattened page count) is used.
+        # Decrypted files must not override the encryption, as objects in
+        # object streams can only be read decrypted.
+        if self.isEncrypted and not hasattr(self, '_decryption_key'):
             try:
                 self._override_encryption = True
                 return self.trailer["/Root"]["/Pages"]["/Count"]
@@ -1977,6 +2260,44 @@ class PageObject(DictionaryObject):
         else:
             return None
 
+    def createFormXObject(self):
+        """
+        Returns this page as a Form XObject, which can be drawn on other
+        pages any number of times with the ``Do`` operator.
+
+        The content streams are not parsed: a single content stream is taken
+        over together with its filters, several content streams are decoded
+        and concatenated. The resources are shared with this page.
+
+        :return: the Form XObject. Its coordinate system is the one of this
+            page and its bounding box is the crop box of this page.
+        :rtype: :class:`StreamObject<PyPDF2.generic.StreamObject>`
+        """
+        contents = self.getContents()
+        if contents is None:
+            streams = []
+        elif isinstance(contents, ArrayObject):
+            streams = [stream.getObject() for stream in contents]
+        else:
+            streams = [contents]
+
+        if len(streams) == 1 and isinstance(streams[0], EncodedStreamObject):
+            xobject = EncodedStreamObject()
+            xobject._data = streams[0]._data
+            for key in ("/Filter", "/DecodeParms"):
+                if key in streams[0]:
+                    xobject[NameObject(key)] = streams[0].raw_get(key)
+        else:
+            xobject = DecodedStreamObject()
+            xobject.setData(b_("\n").join(stream.getData() for stream in streams))
+
+        xobject[NameObject("/Type")] = NameObject("/XObject")
+        xobject[NameObject("/Subtype")] = NameObject("/Form")
+        xobject[NameObject("/BBox")] = RectangleObject(self.cropBox)
+        if "/Resources" in self:
+            xobject[NameObject("/Resources")] = self.raw_get("/Resources")
+        return xobject
+
     def mergePage(self, page2):
         """
         Merges the content streams of two pages into one.  Resource references
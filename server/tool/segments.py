@@ -0,0 +1,267 @@
+"""segments.py: Provides a store for the segments of merged print jobs"""
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from tool.cache import get_build_name
+from tool.merge import ReaderCache, merge_pdf_files, merge_segment_files
+from tool.timings import Timings, add_record, count, phase
+
+__author__ = 'Jim Martens'
+
+
+class SegmentStore:
+    """
+    Manages the segments in the build cache.
+
+    A segment is a single copy of one material, i.e. the selected pages of
+    its file plus the blank padding page for duplex printing. Segments are
+    cached by the fingerprint of their source, so a merged job only builds
+    the segments that are not cached yet and assembles the rest.
+
+    With more than one worker the missing segments of a job are built in
+    parallel by a pool of processes. The segments of child materials can be
+    split from their parent file in advance (see presplit).
+    """
+    PREFIX = 'segment-'
+
+    def __init__(self, cache, fingerprints, readers=None, workers=1, compress_level=None):
+        """
+        Initializes the segment store.
+        :param cache: the build cache for the segment files
+        :type cache: BuildCache
+        :param fingerprints: the fingerprints of the material files
+        :type fingerprints: MaterialFingerprints
+        :param readers: the reader cache for the material files
+        :type readers: ReaderCache
+        :param workers: the number of processes that build segments
+        :type workers: int
+        :param compress_level: the zlib level for streams without a filter or None
+        :type compress_level: int
+        """
+        self._cache = cache
+        self._fingerprints = fingerprints
+        self._readers = readers
+        self._workers = workers
+        self._compressLevel = compress_level
+
+    def get_name(self, material):
+        """
+        Returns the cache name of the segment of a material.
+        :param material: the material
+        :type material: dict
+        :rtype: str
+        """
+        return get_build_name([{'material': material, 'amount': 1}], self._fingerprints, self.PREFIX)
+
+    def get_names(self, merge_data):
+        """
+        Returns the cache names of the segments for the given merge data.
+        :param merge_data: list of dicts with material and amount
+        :type merge_data: list
+        :rtype: list
+        """
+        return [self.get_name(merge_info['material']) for merge_info in merge_data]
+
+    def get_segments(self, merge_data):
+        """
+        Returns the segments for the given merge data in the same order.
+
+        Missing segments are built first, in parallel if there is more than
+        one worker.
+        :param merge_data: list of dicts with material and amount
+        :type merge_data: list
+        :return: list of dicts with the path of a segment and its amount
+        :rtype: list
+        """
+        names = self.get_names(merge_data)
+        missing = OrderedDict()
+        for name, merge_info in zip(names, merge_data):
+            if name not in missing and self._cache.lookup(name, 'segment_') is None:
+                missing[name] = merge_info['material']
+        self._build(missing)
+
+        segments = []
+        for name, merge_info in zip(names, merge_data):
+            segments.append({
+                'path': self._cache.get_path(name),
+                'amount': int(merge_info['amount'])
+            })
+
+        return segments
+
+    def count_pages(self, segments):
+        """
+        Returns the number of pages of the given segments.
+        :param segments: list of dicts with the path of a segment (see get_segments)
+        :type segments: list
+        :rtype: list
+        """
+        readers = self._readers if self._readers is not None else ReaderCache()
+        return [readers.get(segment['path']).getNumPages() for segment in segments]
+
+    def presplit(self, materials):
+        """
+        Builds the segments of the given materials that are not cached yet.
+
+        This is used to extract the pages of child materials from their
+        parent file before any job needs them.
+        :param materials: the materials
+        :type materials: list
+        :return: the number of built segments
+        :rtype: int
+        """
+        missing = OrderedDict()
+        for material in materials:
+            name = self.get_name(material)
+            # checked without a lookup, so presplitting does not count as a cache hit
+            if not os.path.exists(self._cache.get_path(name)):
+                missing[name] = material
+        self._build(missing)
+        return len(missing)
+
+    def assemble(self, name, merge_data, open_copy=None):
+        """
+        Returns the merged file for the given merge data and builds it if necessary.
+
+        The file is assembled from the segments and published atomically
+        under the given cache name. A single copy of a single material is the
+        segment itself, so its path is returned instead of assembling a copy.
+        The caller should pin the name and the segment names while it uses
+        the file.
+        :param name: the cache name of the merged file (see get_build_name)
+        :type name: str
+        :param merge_data: list of dicts with material and amount
+        :type merge_data: list
+        :param open_copy: optional callable that returns a stream, which receives a copy
+                          of the file while it is assembled; only called if the file is built
+        :return: the path of the merged file
+        :rtype: str
+        """
+        if len(merge_data) == 1 and int(merge_data[0]['amount']) == 1:
+            return self.get_segments(merge_data)[0]['path']
+
+        path = self._cache.lookup(name)
+        if path is None:
+            path = self._cache.get_path(name)
+            temporary_path = get_temporary_path(path)
+            segments = self.get_segments(merge_data)
+            copy_stream = open_copy() if open_copy is not None else None
+            try:
+                with phase('assemble'):
+                    merge_segment_files(temporary_path, segments, self._readers, self._compressLevel, copy_stream)
+                os.replace(temporary_path, path)
+            except BaseException:
+                remove_temporary_file(temporary_path)
+                raise
+            self._cache.store(name)
+
+        return path
+
+    def _build(self, missing):
+        """
+        Builds and stores the given segments.
+
+        With several workers the segments are built in parallel. All
+        segments of the same file are built by the same process, so every
+        file is parsed only once.
+        :param missing: the materials by segment name
+        :type missing: OrderedDict
+        """
+        if not missing:
+            return
+        groups = OrderedDict()
+        for name, material in missing.items():
+            groups.setdefault(material['filename'], []).append((self._cache.get_path(name), material))
+
+        with phase('segments'):
+            if self._workers > 1 and len(groups) > 1:
+                with ProcessPoolExecutor(min(self._workers, len(groups))) as executor:
+                    futures = [executor.submit(build_segments, group, None, self._compressLevel, True)
+                               for group in groups.values()]
+                    for future in futures:
+                        add_record(future.result())
+            else:
+                for group in groups.values():
+                    build_segments(group, self._readers, self._compressLevel)
+        count('segments_built', len(missing))
+
+        for name in missing:
+            self._cache.store(name)
+
+
+def build_segments(segments, readers=None, compress_level=None, record=False):
+    """
+    Builds several segments with a shared reader cache.
+    :param segments: list of tuples with the path of a segment and its material
+    :type segments: list
+    :param readers: the reader cache for the material files
+    :type readers: ReaderCache
+    :param compress_level: the zlib level for streams without a filter or None
+    :type compress_level: int
+    :param record: True if the timings should be recorded and returned, because a worker
+                   process cannot add them to the recording of the parent process
+    :type record: bool
+    :return: the timings (see Timings.get_record) if record is True
+    :rtype: dict
+    """
+    if record:
+        timings = Timings('build_segments')
+        with timings.recording():
+            build_segments(segments, readers, compress_level)
+        return timings.get_record()
+
+    if readers is None:
+        readers = ReaderCache()
+    for path, material in segments:
+        build_segment(path, material, readers, compress_level)
+    return None
+
+
+def build_segment(path, material, readers=None, compress_level=None):
+    """
+    Builds the segment of a material.
+
+    The segment is written to a temporary file first, so other processes
+    never see a partially written segment.
+    :param path: the path of the segment
+    :type path: str
+    :param material: the material
+    :type material: dict
+    :param readers: the reader cache for the material files
+    :type readers: ReaderCache
+    :param compress_level: the zlib level for streams without a filter or None
+    :type compress_level: int
+    """
+    temporary_path = get_temporary_path(path)
+    # the materials that dominate the build time can be told apart in the timings
+    try:
+        with phase('segment ' + material['name']):
+            merge_pdf_files(temporary_path, [{'material': material, 'amount': 1}], readers, compress_level)
+        os.replace(temporary_path, path)
+    except BaseException:
+        remove_temporary_file(temporary_path)
+        raise
+
+
+def get_temporary_path(path):
+    """
+    Returns a path to build the given file at, which is unique for this process.
+
+    Several processes (the daemon, the queue worker and the prebuilder) may
+    build the same file at the same time.
+    :type path: str
+    :rtype: str
+    """
+    return '{}.{}.tmp'.format(path, os.getpid())
+
+
+def remove_temporary_file(temporary_path):
+    """
+    Removes the temporary file of a failed build, which is not managed by the cache.
+    :type temporary_path: str
+    """
+    try:
+        os.remove(temporary_path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,194 @@
+"""timings.py: Provides the measurement of the phases of oeprint commands"""
+import json
+import logging
+import os
+import sys
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+__author__ = 'Jim Martens'
+
+TIMINGS_LOG_FILE = 'timings.log'
+
+# the timings log is rotated at 1 MB and 5 old logs are kept
+TIMINGS_LOG_SIZE = 1024 * 1024
+TIMINGS_LOG_BACKUPS = 5
+
+# the timings that are recorded at the moment or None
+_recording = None  # type: Timings
+
+
+class Timings:
+    """
+    Records the wall and CPU time of the phases of a command and counters.
+
+    The CPU time includes the child processes that have finished, i.e. the
+    segment workers and lpr. A phase that is entered several times is
+    accumulated. Phases may be nested, the time of an inner phase is part of
+    the outer phase as well.
+    """
+    def __init__(self, command):
+        """
+        Initializes the timings.
+        :param command: the command that is measured
+        :type command: str
+        """
+        self._command = command
+        self._phases = OrderedDict()
+        self._counts = OrderedDict()
+        self._start = None  # type: tuple
+        self._total = None  # type: tuple
+
+    @contextmanager
+    def recording(self):
+        """
+        Records the timings of all phases that are entered in the with block.
+        """
+        global _recording
+        previous = _recording
+        _recording = self
+        self._start = get_times()
+        try:
+            yield self
+        finally:
+            _recording = previous
+            self._total = subtract_times(get_times(), self._start)
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Measures the with block as the given phase.
+        :param name: the name of the phase
+        :type name: str
+        """
+        start = get_times()
+        try:
+            yield
+        finally:
+            wall, cpu = subtract_times(get_times(), start)
+            phase = self._phases.setdefault(name, {'wall': 0.0, 'cpu': 0.0, 'calls': 0})
+            phase['wall'] += wall
+            phase['cpu'] += cpu
+            phase['calls'] += 1
+
+    def count(self, name, amount=1):
+        """
+        Increases a counter.
+        :param name: the name of the counter
+        :type name: str
+        :param amount: the amount to add
+        :type amount: int
+        """
+        self._counts[name] = self._counts.get(name, 0) + amount
+
+    def add_record(self, record):
+        """
+        Adds the phases and counters of another record, for example of a worker process.
+
+        The phases of workers that ran in parallel are summed up, so they may
+        take longer in total than the phase of this process around them.
+        :param record: the timings (see get_record)
+        :type record: dict
+        """
+        for name, other in record['phases'].items():
+            phase = self._phases.setdefault(name, {'wall': 0.0, 'cpu': 0.0, 'calls': 0})
+            phase['wall'] += other['wall']
+            phase['cpu'] += other['cpu']
+            phase['calls'] += other['calls']
+        for name, amount in record['counts'].items():
+            self.count(name, amount)
+
+    def get_record(self):
+        """
+        Returns the timings of the finished recording.
+        :return: dict with command, wall and CPU time, phases and counts
+        :rtype: dict
+        """
+        wall, cpu = self._total
+        return OrderedDict([
+            ('time', round(time.time(), 3)),
+            ('command', self._command),
+            ('wall', round(wall, 4)),
+            ('cpu', round(cpu, 4)),
+            ('phases', OrderedDict((name, {
+                'wall': round(phase['wall'], 4),
+                'cpu': round(phase['cpu'], 4),
+                'calls': phase['calls']
+            }) for name, phase in self._phases.items())),
+            ('counts', self._counts)
+        ])
+
+
+@contextmanager
+def phase(name):
+    """
+    Measures the with block as the given phase of the current recording.
+
+    Without a recording nothing is measured.
+    :param name: the name of the phase
+    :type name: str
+    """
+    if _recording is None:
+        yield
+    else:
+        with _recording.phase(name):
+            yield
+
+
+def count(name, amount=1):
+    """
+    Increases a counter of the current recording.
+    :param name: the name of the counter
+    :type name: str
+    :param amount: the amount to add
+    :type amount: int
+    """
+    if _recording is not None:
+        _recording.count(name, amount)
+
+
+def add_record(record):
+    """
+    Adds the phases and counters of another record to the current recording.
+    :param record: the timings (see Timings.get_record)
+    :type record: dict
+    """
+    if _recording is not None:
+        _recording.add_record(record)
+
+
+def report_timings(record, log_file=TIMINGS_LOG_FILE):
+    """
+    Writes the timings as one JSON line to stderr and appends them to the timings log.
+    :param record: the timings (see Timings.get_record)
+    :type record: dict
+    :param log_file: the path of the timings log
+    :type log_file: str
+    """
+    line = json.dumps(record)
+    sys.stderr.write(line + '\n')
+    handler = RotatingFileHandler(log_file, maxBytes=TIMINGS_LOG_SIZE, backupCount=TIMINGS_LOG_BACKUPS,
+                                  encoding='utf-8')
+    try:
+        handler.emit(logging.makeLogRecord({'msg': line}))
+    finally:
+        handler.close()
+
+
+def get_times():
+    """
+    Returns the wall time and the CPU time of this process and its finished children.
+    :rtype: tuple
+    """
+    times = os.times()
+    return time.perf_counter(), times[0] + times[1] + times[2] + times[3]
+
+
+def subtract_times(end, start):
+    """
+    Returns the difference of two results of get_times.
+    :rtype: tuple
+    """
+    return end[0] - start[0], end[1] - start[1]
@@ -0,0 +1,140 @@
+"""watch.py: Provides the prebuilder that keeps the saved configurations built"""
+import os
+import sys
+import time
+
+from tool.cache import get_build_name
+from tool.materials import get_configuration_amounts, get_merge_data
+
+__author__ = 'Jim Martens'
+
+DEFAULT_INTERVAL = 10
+
+# the prebuilder must not slow down the print jobs
+NICENESS = 10
+
+
+class Prebuilder:
+    """
+    Rebuilds the saved configurations of data.json when their materials change.
+
+    The pages of the child materials are split from their parent files into
+    segments first, so jobs never need to slice the parent files. The
+    material files are polled. A changed file is only used once it has
+    not changed for a whole interval, so files that are still being copied
+    are not built. All configurations are built once after the start and
+    again whenever data.json changes; builds that are still cached are not
+    repeated. The builds are published atomically in the build cache, so
+    print jobs either find the complete file or build it themselves.
+    """
+    def __init__(self, context, interval=None):
+        """
+        Initializes the prebuilder.
+        :param context: the context that is used for the builds
+        :type context: PrintContext
+        :param interval: the poll interval in seconds, by default it is read from data.json
+        :type interval: float
+        """
+        self._context = context
+        self._interval = interval
+        self._configData = None  # type: dict
+        self._states = {}
+        self._modified = set()
+
+    def run(self):
+        """
+        Polls the material files and prebuilds until the process is terminated.
+        """
+        os.nice(NICENESS)
+        while True:
+            self.poll()
+            interval = self._interval
+            if interval is None:
+                interval = float(self._context.get_config_data().get('watch', {}).get('interval', DEFAULT_INTERVAL))
+            time.sleep(interval)
+
+    def poll(self):
+        """
+        Checks the material files once and prebuilds the affected configurations.
+        """
+        self._context.start_job()
+        config_data = self._context.get_config_data()
+        materials = self._context.get_materials()
+        states = {}
+        for material in materials.values():
+            try:
+                stat = os.stat(material['filename'])
+            except FileNotFoundError:
+                states[material['filename']] = None
+            else:
+                states[material['filename']] = (stat.st_size, stat.st_mtime_ns)
+
+        modified = {filename for filename, state in states.items() if state != self._states.get(filename)}
+        ready = {filename for filename in self._modified - modified if states.get(filename) is not None}
+        reloaded = config_data is not self._configData
+        self._states = states
+        self._modified = modified
+        self._configData = config_data
+
+        # the children are split from their parent files before the configurations use them
+        children = [material for material in materials.values()
+                    if 'pages' in material and material['filename'] not in modified
+                    and states[material['filename']] is not None
+                    and (reloaded or material['filename'] in ready)]
+        self.presplit(children)
+
+        for configuration in config_data['configurations']:
+            try:
+                amounts = get_configuration_amounts(config_data['configurations'], configuration['name'])
+                merge_data = get_merge_data(materials, amounts)
+            except (KeyError, ValueError) as error:
+                print('Invalid configuration {}: {}'.format(configuration['name'], error), file=sys.stderr)
+                continue
+
+            filenames = {merge_info['material']['filename'] for merge_info in merge_data}
+            if not merge_data or filenames & modified:
+                continue
+            if reloaded or filenames & ready:
+                self.prebuild(configuration['name'], merge_data)
+
+    def presplit(self, materials):
+        """
+        Builds the segments of the given child materials unless they are cached.
+        :param materials: the child materials
+        :type materials: list
+        """
+        if not materials:
+            return
+        start_time = time.time()
+        try:
+            built = self._context.get_segment_store().presplit(materials)
+        except FileNotFoundError as fnfe:
+            print('Cannot split the child materials: ' + fnfe.strerror, file=sys.stderr)
+            return
+
+        if built:
+            print('Split {} child materials in {:.3f}s'.format(built, time.time() - start_time), flush=True)
+
+    def prebuild(self, name, merge_data):
+        """
+        Builds the merged file of a configuration unless it is cached.
+        :param name: the name of the configuration
+        :type name: str
+        :param merge_data: list of dicts with material and amount
+        :type merge_data: list
+        """
+        cache = self._context.get_cache()
+        segment_store = self._context.get_segment_store()
+        start_time = time.time()
+        try:
+            build_name = get_build_name(merge_data, self._context.get_fingerprints())
+            # checked without a lookup, so the prebuilder does not count as a cache hit
+            if os.path.exists(cache.get_path(build_name)):
+                return
+            with cache.pinned(build_name, *segment_store.get_names(merge_data)):
+                segment_store.assemble(build_name, merge_data)
+        except FileNotFoundError as fnfe:
+            print('Cannot build {}: {}'.format(name, fnfe.strerror), file=sys.stderr)
+            return
+
+        print('Prebuilt {} in {:.3f}s'.format(name, time.time() - start_time), flush=True)